@@ -0,0 +1,364 @@
+"""
+Aggregations over the parsings in the column store. Every aggregator
+declares the columns it reads; AggregateStore reads the union of those
+columns once for the songs that changed, splits the rows into chunks of
+about the same size in bytes for a Pool, and materializes per-song results
+so group totals can be summed without touching the parsings at all.
+"""
+from collections import Counter, defaultdict
+from functools import cache, partial
+from itertools import chain
+from multiprocessing import Pool
+from hashlib import sha1
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+import json
+import re
+import sqlite3
+from columns import ColumnStore
+import scheduling
+
+# Group that corpus-wide aggregators are reported under
+CORPUS = "*"
+
+def detect_rhyme_scheme(scheme: str):
+	if not scheme:
+		return None
+	
+	# monorhyme: /A+/
+	if len(set(scheme)) == 1:
+		return 'monorhyme'
+
+	# enclosed rhyme: ABBA
+	if re.search(r'(?P<outer>\w)(?P<inner>\w)(?P=inner)(?P=outer)', scheme):
+		return 'enclosed'
+	
+	# alternating rhyme: ABAB
+	if re.search(r"(?P<first>\w)(?P<second>\w)(?P=first)(?P=second)", scheme):
+		return 'alternating'
+
+	# clumped rhyme: ABAB
+	if re.search(r"(?P<first>\w)(?P=first)(?P<second>\w)(?P=second)", scheme):
+		return 'clumped'
+
+def unpack_stress(mask: int) -> List[bool]:
+	"""
+	Syllable stresses of a line packed by parse_lyrics.stress_mask.
+	"""
+	return [bool(mask >> index & 1) for index in range(mask.bit_length() - 1)]
+
+# Stressed syllable positions of each foot, with the foot's length
+FEET = {
+	'iambic': ((1,), 2),
+	'trochaic': ((0,), 2),
+	'anapestic': ((2,), 3),
+	'dactylic': ((0,), 3),
+}
+METER_MIN_SYLLABLES = 4
+METER_MIN_MATCH = 0.8
+
+@cache
+def foot_masks(syllables: int) -> Dict[str, int]:
+	return {
+		meter: sum(1 << index for index in range(syllables) if index % length in stressed)
+		for meter, (stressed, length)
+		in FEET.items()
+	}
+
+def detect_meter(mask: int) -> Optional[str]:
+	"""
+	The foot a line's stresses follow best, if at least METER_MIN_MATCH of
+	its syllables fit it; 'irregular' otherwise. Lines too short to tell
+	have no meter.
+	"""
+	syllables = mask.bit_length() - 1
+	if syllables < METER_MIN_SYLLABLES:
+		return None
+
+	stresses = mask ^ (1 << syllables)
+	every_syllable = (1 << syllables) - 1
+	# Count the syllables that agree with each foot's ideal pattern
+	meter, matches = max(
+		((meter, bin(~(stresses ^ ideal) & every_syllable).count("1")) for meter, ideal in foot_masks(syllables).items()),
+		key=lambda item: item[1],
+	)
+	return meter if matches >= METER_MIN_MATCH * syllables else 'irregular'
+
+class Aggregator:
+	name: str
+	columns: Tuple[str, ...]
+	# Aggregate the whole corpus under CORPUS instead of per group
+	corpus_wide: bool = False
+	# Bump whenever add() changes so materialized results get recomputed
+	version: int = 1
+
+	def empty(self) -> Any:
+		return Counter()
+
+	def to_json(self, acc: Any) -> Any:
+		return list(acc.items())
+
+	def from_json(self, value: Any) -> Any:
+		return Counter(dict((key, count) for key, count in value))
+
+	def add(self, acc: Any, *values: Any):
+		raise NotImplementedError
+
+	def merge(self, acc: Any, other: Any) -> Any:
+		acc.update(other)
+		return acc
+
+class Sentiment(Aggregator):
+	name = 'sentiment'
+	columns = ('sentiment',)
+
+	def empty(self) -> dict:
+		return {'total': 0, 'sentiments': Counter()}
+
+	def add(self, acc: dict, sentiment: List[List[dict]]):
+		for line in chain.from_iterable(sentiment):
+			acc['sentiments'].update({ k: v * 100 for k, v in line.items() })
+			acc['total'] += 100
+
+	def merge(self, acc: dict, other: dict) -> dict:
+		acc['total'] += other['total']
+		acc['sentiments'].update(other['sentiments'])
+		return acc
+
+	def to_json(self, acc: dict) -> Any:
+		return {'total': acc['total'], 'sentiments': dict(acc['sentiments'])}
+
+	def from_json(self, value: Any) -> dict:
+		return {'total': value['total'], 'sentiments': Counter(value['sentiments'])}
+
+class RhymeSchemes(Aggregator):
+	name = 'rhyme_schemes'
+	columns = ('rhyme_structure',)
+
+	def add(self, acc: Counter, rhyme_structure: List[str]):
+		acc.update(detect_rhyme_scheme(rhyme_scheme) for rhyme_scheme in rhyme_structure)
+
+class Meter(Aggregator):
+	name = 'meter'
+	columns = ('stress',)
+
+	def add(self, acc: Counter, stress: Optional[List[List[int]]]):
+		# Parsings from before the stress analysis have none
+		if stress:
+			acc.update(detect_meter(mask) for mask in chain.from_iterable(stress))
+
+class RhymePairs(Aggregator):
+	name = 'rhyme_pairs'
+	columns = ('rhymes',)
+	corpus_wide = True
+
+	def add(self, acc: Counter, rhymes: List[List[List[str]]]):
+		acc.update(frozenset(rhyme) for rhyme in chain.from_iterable(rhymes))
+
+	def to_json(self, acc: Counter) -> Any:
+		return [(sorted(pair), count) for pair, count in acc.items()]
+
+	def from_json(self, value: Any) -> Counter:
+		return Counter({frozenset(pair): count for pair, count in value})
+
+Results = Dict[Hashable, Dict[str, Any]]
+
+_aggregators: List[Aggregator] = []
+_columns: Tuple[str, ...] = ()
+
+def _init_worker(aggregators: List[Aggregator], columns: Tuple[str, ...]):
+	global _aggregators, _columns
+	_aggregators = aggregators
+	_columns = columns
+
+def row_size(row: tuple) -> int:
+	# Rows end with their raw column values
+	return sum(map(len, row[-1]))
+
+def chunk_budget(store: ColumnStore, columns: Iterable[str]) -> int:
+	"""
+	Bytes per chunk of rows, so that every worker gets a few chunks of the
+	columns read.
+	"""
+	paths = [store.column_path(column) for column in columns]
+	return scheduling.batch_budget(sum(path.stat().st_size for path in paths if path.exists()))
+
+def song_aggregators() -> List[Aggregator]:
+	"""
+	Aggregators that AggregateStore keeps per song. Word and category
+	frequencies come from vocabulary.FrequencyMatrix instead.
+	"""
+	return [Sentiment(), RhymeSchemes(), Meter(), RhymePairs()]
+
+def aggregate_song(aggregators: List[Aggregator], values: Dict[str, Any]) -> Dict[str, Any]:
+	results = {}
+	for aggregator in aggregators:
+		acc = aggregator.empty()
+		aggregator.add(acc, *(values[column] for column in aggregator.columns))
+		results[aggregator.name] = aggregator.to_json(acc)
+	return results
+
+def _aggregate_song_rows(rows: List[Tuple[str, int, Tuple[bytes, ...]]]) -> List[Tuple[str, int, Dict[str, Any]]]:
+	return [
+		(song_id, source_row, aggregate_song(_aggregators, dict(zip(_columns, map(json.loads, raw_values)))))
+		for song_id, source_row, raw_values
+		in rows
+	]
+
+class AggregateStore:
+	"""
+	Per-song aggregator results in parsings/aggregates.sqlite, keyed by song
+	id and aggregator, along with the aggregator version and the column
+	store row they were computed from. A song is stale once it has been
+	re-parsed (its latest row moved) or its aggregator's version changed.
+
+	Group totals are memoized until any song changes.
+	"""
+	def __init__(self, path: Path = Path.cwd() / "parsings" / "aggregates.sqlite", aggregators: Optional[List[Aggregator]] = None):
+		self.aggregators = aggregators or song_aggregators()
+		path.parent.mkdir(parents=True, exist_ok=True)
+		self.connection = sqlite3.connect(path, timeout=30)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.executescript("""
+			CREATE TABLE IF NOT EXISTS song_aggregates (
+				song_id TEXT NOT NULL,
+				aggregator TEXT NOT NULL,
+				version INTEGER NOT NULL,
+				source_row INTEGER NOT NULL,
+				value TEXT NOT NULL,
+				PRIMARY KEY (song_id, aggregator)
+			);
+			CREATE TABLE IF NOT EXISTS group_totals (
+				key TEXT PRIMARY KEY,
+				revision INTEGER NOT NULL,
+				value TEXT NOT NULL
+			);
+			CREATE TABLE IF NOT EXISTS meta (
+				name TEXT PRIMARY KEY,
+				value INTEGER NOT NULL
+			);
+			INSERT OR IGNORE INTO meta (name, value) VALUES ('revision', 0);
+		""")
+		self.connection.commit()
+
+	@property
+	def revision(self) -> int:
+		return self.connection.execute("SELECT value FROM meta WHERE name = 'revision'").fetchone()[0]
+
+	def _put(self, rows: Iterable[Tuple[str, int, Dict[str, Any]]]):
+		versions = {aggregator.name: aggregator.version for aggregator in self.aggregators}
+		self.connection.executemany(
+			"INSERT OR REPLACE INTO song_aggregates (song_id, aggregator, version, source_row, value) VALUES (?, ?, ?, ?, ?)",
+			(
+				(song_id, name, versions[name], source_row, json.dumps(value, separators=(",", ":")))
+				for song_id, source_row, results in rows
+				for name, value in results.items()
+			),
+		)
+		self.connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'revision'")
+		self.connection.commit()
+
+	def update(self, parsing: dict, source_row: int):
+		"""
+		Materialize a freshly written parsing; called by parse_lyrics.
+		"""
+		self._put([(parsing['id'], source_row, aggregate_song(self.aggregators, parsing))])
+
+	def stale(self, store: ColumnStore) -> Dict[str, int]:
+		"""
+		Songs in `store` whose aggregates are missing or out of date, with the
+		row they should be computed from.
+		"""
+		latest = store.latest_rows()
+		current = Counter()
+		versions = {aggregator.name: aggregator.version for aggregator in self.aggregators}
+		for song_id, name, version, source_row in self.connection.execute("SELECT song_id, aggregator, version, source_row FROM song_aggregates"):
+			if versions.get(name) == version and latest.get(song_id) == source_row:
+				current[song_id] += 1
+		return {song_id: row for song_id, row in latest.items() if current[song_id] < len(self.aggregators)}
+
+	def refresh(self, store: ColumnStore, chunk_bytes: Optional[int] = None):
+		stale = self.stale(store)
+		if not stale:
+			return
+
+		print("Aggregating", len(stale), "songs")
+		columns = tuple(dict.fromkeys(column for aggregator in self.aggregators for column in aggregator.columns))
+		rows = (
+			(song_id, stale[song_id], tuple(raw_values))
+			for song_id, *raw_values
+			in store.scan(*columns, ids=stale.keys(), decode=False)
+		)
+
+		chunks = scheduling.sized_batches(rows, row_size, chunk_bytes or chunk_budget(store, columns))
+		utilization = scheduling.Utilization()
+		with Pool(initializer=_init_worker, initargs=(self.aggregators, columns)) as p:
+			for batch, busy in p.imap_unordered(partial(scheduling.timed, _aggregate_song_rows), chunks):
+				utilization.add(busy)
+				self._put(batch)
+		utilization.report(f"Aggregated {len(stale)} songs")
+
+	def group_totals(self, groups: Dict[Hashable, Iterable[str]]) -> Results:
+		"""
+		Sum the per-song results of every group (group -> track ids). Corpus-wide
+		aggregators are summed over the union of all groups under CORPUS.
+		"""
+		groups = {group: sorted(set(track_ids)) for group, track_ids in groups.items()}
+		revision = self.revision
+		key = sha1(json.dumps([
+			[(aggregator.name, aggregator.version) for aggregator in self.aggregators],
+			list(groups.items()),
+		]).encode()).hexdigest()
+
+		if (cached := self.connection.execute("SELECT revision, value FROM group_totals WHERE key = ?", (key,)).fetchone()) and cached[0] == revision:
+			return self._results_from_json(json.loads(cached[1]))
+
+		by_name = {aggregator.name: aggregator for aggregator in self.aggregators}
+		members: Dict[str, List[Hashable]] = defaultdict(list)
+		for group, track_ids in groups.items():
+			for track_id in track_ids:
+				members[track_id].append(group)
+
+		results: Results = {
+			group: {aggregator.name: aggregator.empty() for aggregator in self.aggregators if not aggregator.corpus_wide}
+			for group in groups
+		}
+		results[CORPUS] = {aggregator.name: aggregator.empty() for aggregator in self.aggregators if aggregator.corpus_wide}
+
+		for song_id, name, value in self.connection.execute("SELECT song_id, aggregator, value FROM song_aggregates"):
+			if song_id not in members or name not in by_name:
+				continue
+			aggregator = by_name[name]
+			acc = aggregator.from_json(json.loads(value))
+			for group in ([CORPUS] if aggregator.corpus_wide else members[song_id]):
+				results[group][name] = aggregator.merge(results[group][name], acc)
+
+		self.connection.execute(
+			"INSERT OR REPLACE INTO group_totals (key, revision, value) VALUES (?, ?, ?)",
+			(key, revision, json.dumps(self._results_to_json(results))),
+		)
+		self.connection.commit()
+		return results
+
+	def _results_to_json(self, results: Results) -> list:
+		by_name = {aggregator.name: aggregator for aggregator in self.aggregators}
+		return [
+			[group, {name: by_name[name].to_json(acc) for name, acc in accs.items()}]
+			for group, accs in results.items()
+		]
+
+	def _results_from_json(self, value: list) -> Results:
+		by_name = {aggregator.name: aggregator for aggregator in self.aggregators}
+		return {
+			group: {name: by_name[name].from_json(acc) for name, acc in accs.items()}
+			for group, accs in value
+		}
+
+	def close(self):
+		self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
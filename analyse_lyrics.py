@@ -1,31 +1,53 @@
-import json
-import gzip
-from csv import DictReader
 from pathlib import Path
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-from itertools import islice, groupby, chain
-from operator import itemgetter
-from multiprocessing import Pool
-from collections import Counter, defaultdict
+from itertools import chain
+from functools import cache
+from os import environ
 from pprint import pprint
-import nltk
-import matplotlib.ticker as mtick
-from matplotlib.font_manager import FontProperties
-import matplotlib, mplcairo
-import re
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+from columns import ColumnStore
+from aggregates import CORPUS, AggregateStore, Results
+from songs import SongIndex
+
+if TYPE_CHECKING:
+	from vocabulary import FrequencyMatrix
+
+store = ColumnStore()
+# Count every cluster of near-duplicate songs (see dedupe.py) once
+count_clusters = False
+
+@cache
+def word_lists() -> Dict[str, List[str]]:
+	from lemmas import lemmatizer
+
+	word_lists = {
+		path.stem: [lemmatizer.lemmatize(word.strip()) for word in path.read_text("utf-8").splitlines()]
+		for path
+		in (Path.cwd() / "words").glob("*.txt")
+	}
+	lemmatizer.save()
+	return word_lists
 
-matplotlib.use("module://mplcairo.gtk")
+def pyplot():
+	"""
+	pyplot and ticker on a backend that doesn't need a display (charts are
+	only ever saved to files), unless MPLBACKEND picks one.
+	"""
+	import matplotlib
 
-lemmatizer = nltk.wordnet.WordNetLemmatizer()
+	if "MPLBACKEND" not in environ:
+		try:
+			import mplcairo
+			matplotlib.use("module://mplcairo.base")
+		except ImportError:
+			matplotlib.use("Agg")
 
-parsings_dir = Path.cwd() / "parsings"
+	import matplotlib.pyplot as plt
+	import matplotlib.ticker as mtick
+	return plt, mtick
 
-word_lists = {
-	path.stem: [lemmatizer.lemmatize(word.strip()) for word in path.read_text("utf-8").splitlines()]
-	for path
-	in (Path.cwd() / "words").glob("*.txt")
-}
+def frequency_matrix() -> "FrequencyMatrix":
+	from vocabulary import FrequencyMatrix
+	return FrequencyMatrix.load(store)
 
 # https://github.com/bfelbo/DeepMoji/blob/master/emoji_overview.png
 # https://github.com/bfelbo/DeepMoji/blob/master/emoji_unicode.csv
@@ -39,177 +61,64 @@ word_lists = {
 # 	anger={'😒', '😡', '😤', '😠', },
 # )
 
-def detect_rhyme_scheme(scheme: str):
-	if not scheme:
-		return None
-	
-	# monorhyme: /A+/
-	if len(set(scheme)) == 1:
-		return 'monorhyme'
-
-	# enclosed rhyme: ABBA
-	if re.search(r'(?P<outer>\w)(?P<inner>\w)(?P=inner)(?P=outer)', scheme):
-		return 'enclosed'
-	
-	# alternating rhyme: ABAB
-	if re.search(r"(?P<first>\w)(?P<second>\w)(?P=first)(?P=second)", scheme):
-		return 'alternating'
-
-	# clumped rhyme: ABAB
-	if re.search(r"(?P<first>\w)(?P=first)(?P<second>\w)(?P=second)", scheme):
-		return 'clumped'
-
-def extract_id(url: str):
-	return url.split("/")[-1]
-
-# Sources
-def top_songs():
-	f = open("top_songs.csv")
-
-	try:
-		yield from DictReader(f)
-	finally:
-		f.close()
-
-def top_blues():
-	f = open("top_blues.csv")
-	try:
-		yield from islice(DictReader(f), 5000)
-	finally:
-		f.close()
-
-def top_pop():
-	f = open("top_pop.csv")
-	try:
-		yield from islice(DictReader(f), 5000)
-	finally:
-		f.close()
-
-def top_rock():
-	f = open("top_rock.csv")
-	try:
-		yield from islice(DictReader(f), 5000)
-	finally:
-		f.close()
-
-def top_rap():
-	f = open("top_rap.csv")
-	try:
-		yield from islice(DictReader(f), 5000)
-	finally:
-		f.close()
-
-source = sorted(top_songs(), key=itemgetter('release_year'))
-# By year
-# grouping = { k: list(v) for k, v in groupby(source, itemgetter('release_year')) }
-# By decade
-grouping = { k: list(v) for k, v in groupby(source, lambda x: x['release_year'][2] + '0s' if x['release_year'] else '') }
-
-def load_word_frequencies(path: Path):
-	with gzip.open(path, 'rt', encoding="utf-8") as f:
-		parsing = json.load(f)
-		return parsing['freqs']
-
-def load_word_frequencies_filter_by_category(path: Path):
-	with gzip.open(path, 'rt', encoding="utf-8") as f:
-		parsing = json.load(f)
-		stanzas_freqs = parsing['freqs']
-
-	return (
-		[ 
-			{
-				category: { k: v for k, v in stanza_freqs.items() if k in word_list }
-				for category, word_list
-				in word_lists.items()
-			}
-			for stanza_freqs
-			in stanzas_freqs
-		],
-		sum(Counter(stanza_freqs).total() for stanza_freqs in stanzas_freqs),
-	)
-
-def load_rhyme_frequencies(path: Path):
-	with gzip.open(path, 'rt', encoding="utf-8") as f:
-		parsing = json.load(f)
-		return Counter(frozenset(rhyme) for rhyme in chain.from_iterable(parsing['rhymes']))
-
-def load_rhyme_schemes(path: Path):
-	with gzip.open(path, 'rt', encoding="utf-8") as f:
-		parsing = json.load(f)
-		return Counter(detect_rhyme_scheme(rhyme_scheme) for rhyme_scheme in parsing['rhyme_structure'])
-
-def frequency_by_group():
-	for group, songs in grouping.items():
-		if not group:
-			continue
-
+@cache
+def songs() -> SongIndex:
+	return SongIndex.load(Path.cwd() / "top_songs.csv")
+
+@cache
+def aggregate_store() -> AggregateStore:
+	return AggregateStore()
+
+@cache
+def decade_groups() -> Dict[str, Set[str]]:
+	# By year: songs().groups('year')
+	groups = {group: set(track_ids) for group, track_ids in songs().groups('decade')}
+	if count_clusters:
+		from dedupe import collapse, load_clusters
+		groups = collapse(groups, load_clusters())
+	return groups
+
+def scan_groups() -> Results:
+	"""
+	Totals of every aggregator for every decade, summed from the per-song
+	results in the aggregate store. Only songs parsed since the last run are
+	read from the parsings.
+	"""
+	aggregate_store().refresh(store)
+	return aggregate_store().group_totals(decade_groups())
+
+def frequency_by_group(matrix: Optional["FrequencyMatrix"] = None):
+	from wordcloud import WordCloud
+
+	matrix = matrix or frequency_matrix()
+	groups = {group: track_ids for group, track_ids in decade_groups().items() if group}
+	frequencies = matrix.group_frequencies(groups)
+
+	for group, track_ids in groups.items():
 		print(group)
-		track_ids = {extract_id(song['spotify']) for song in songs}
-
-		word_freq = Counter()
-
-		with Pool() as p:
-			for index, stanza_freqs in enumerate(p.imap_unordered(
-				load_word_frequencies,
-				(file for track_id in track_ids if (file := parsings_dir / f"{track_id}.json.gz").exists())
-			)):
-				print(index)
-				for stanza_freq in stanza_freqs:
-					word_freq.update(stanza_freq)
 		
 		try:
 			wc = WordCloud(width=1920*2, height=1080*2)
-			wc.generate_from_frequencies(word_freq)
+			wc.generate_from_frequencies(frequencies[group])
 			wc.to_file(f"output/word_freq/{group} ({len(track_ids)} songs).png")
 		except ValueError:
 			print("No lyrics for this group. :(")
 
-def category_frequency_by_group():
-	storage = {}
-
-	for group, songs in grouping.items():
-		if not group or group in ['40s', '50s']:
-			continue
-
-		print(group)
-		track_ids = {extract_id(song['spotify']) for song in songs}
-
-		frequencies = {
-			'total': 0,
-			**{
-				category: Counter()
-				for category
-				in word_lists.keys()
-			}
-		}
-
-		with Pool() as p:
-			for index, (stanza_freqs, total) in enumerate(p.imap_unordered(
-				load_word_frequencies_filter_by_category,
-				(file for track_id in track_ids if (file := parsings_dir / f"{track_id}.json.gz").exists())
-			)):
-				print(index)
-				frequencies['total'] += total
-				for stanza_freq in stanza_freqs:
-					for category, counts in stanza_freq.items():
-						frequencies[category].update(counts)
-		
-		storage[group] = frequencies
+def category_frequency_by_group(matrix: Optional["FrequencyMatrix"] = None):
+	matrix = matrix or frequency_matrix()
+	groups = {group: track_ids for group, track_ids in decade_groups().items() if group and group not in ['40s', '50s']}
+	category_counts, totals = matrix.category_totals(groups, word_lists())
 
 	percentages = {
-		group: {
-			category: freqs.total() / frequencies['total'] * 100
-			for category, freqs
-			in frequencies.items()
-			if category != 'total'
-		}
-		for group, frequencies
-		in storage.items()
+		group: dict(zip(word_lists().keys(), counts / total * 100))
+		for group, counts, total
+		in zip(groups.keys(), category_counts, totals)
 	}
 
+	plt, mtick = pyplot()
 	fig, ax = plt.subplots()
 	ax.yaxis.set_major_formatter(mtick.PercentFormatter())
-	for category in word_lists.keys():
+	for category in word_lists().keys():
 		ax.plot(percentages.keys(), [percs[category] for percs in percentages.values()], label=category)
 
 	ax.set_title("Word frequency by category over time")
@@ -220,60 +129,22 @@ def category_frequency_by_group():
 	fig.set_size_inches(11, 8.5)
 	fig.savefig("output/frequency_by_category.png")
 
-def most_common_rhymes():
-	track_ids = {extract_id(song['spotify']) for song in source}
-
-	rhyme_freqs = Counter()
-
-	with Pool() as p:
-		for index, rhyme_freq in enumerate(p.imap_unordered(
-			load_rhyme_frequencies,
-			(file for track_id in track_ids if (file := parsings_dir / f"{track_id}.json.gz").exists())
-		)):
-			# print(index)
-			rhyme_freqs.update(rhyme_freq)
+def most_common_rhymes(results: Optional[Results] = None):
+	results = results or scan_groups()
+	rhyme_freqs = results[CORPUS]['rhyme_pairs']
 
 	print("Top 100 rhymes:")
 	pprint(rhyme_freqs.most_common(100))
 
-def load_sentiments(path: Path):
-	with gzip.open(path, 'rt', encoding="utf-8") as f:
-		parsing = json.load(f)
-		sentiments = list(chain.from_iterable(parsing['sentiment']))
-
-		counter = Counter()
-		for line in sentiments:
-			counter.update(Counter({ k: v * 100 for k, v in line.items() }))
-
-		return (
-			counter,
-			len(sentiments) * 100,
-		)
-
-def sentiment_by_group():
-	storage = {}
-
-	for group, songs in grouping.items():
-		if not group or group in ['40s', '50s']:
-			continue
-
-		print(group)
-		track_ids = {extract_id(song['spotify']) for song in songs}
-
-		frequencies = {
-			'total': 0,
-			'sentiments': Counter()
-		}
+def sentiment_by_group(results: Optional[Results] = None):
+	results = results or scan_groups()
 
-		with Pool() as p:
-			for index, (sentiments, total) in enumerate(p.imap_unordered(
-				load_sentiments,
-				(file for track_id in track_ids if (file := parsings_dir / f"{track_id}.json.gz").exists())
-			)):
-				frequencies['sentiments'].update(sentiments)
-				frequencies['total'] += total
-
-		storage[group] = frequencies
+	storage = {
+		group: results[group]['sentiment']
+		for group
+		in decade_groups().keys()
+		if group and group not in ['40s', '50s']
+	}
 
 	percentages_ungrouped = {
 		group: {
@@ -295,6 +166,7 @@ def sentiment_by_group():
 		in percentages_ungrouped.items()
 	}
 
+	plt, mtick = pyplot()
 	fig, ax = plt.subplots()
 	ax.yaxis.set_major_formatter(mtick.PercentFormatter())
 	for emotion in percentages[list(storage.keys())[0]].keys():
@@ -314,26 +186,15 @@ def sentiment_by_group():
 	fig.set_size_inches(11, 8.5)
 	fig.savefig("output/sentiment.png")
 
-def most_common_rhyme_schemes():
-	storage = {}
+def most_common_rhyme_schemes(results: Optional[Results] = None):
+	results = results or scan_groups()
 
-	for group, songs in grouping.items():
-		if not group or group in ['40s', '50s']:
-			continue
-
-		print(group)
-		track_ids = {extract_id(song['spotify']) for song in songs}
-
-		rhyme_schemes_count = Counter()
-
-		with Pool() as p:
-			for index, rhyme_schemes in enumerate(p.imap_unordered(
-				load_rhyme_schemes,
-				(file for track_id in track_ids if (file := parsings_dir / f"{track_id}.json.gz").exists())
-			)):
-				rhyme_schemes_count.update(rhyme_schemes)
-
-		storage[group] = rhyme_schemes_count
+	storage = {
+		group: results[group]['rhyme_schemes']
+		for group
+		in decade_groups().keys()
+		if group and group not in ['40s', '50s']
+	}
 
 	percentages = {
 		group: {
@@ -346,6 +207,7 @@ def most_common_rhyme_schemes():
 		in storage.items()
 	}
 	
+	plt, mtick = pyplot()
 	fig, ax = plt.subplots()
 	ax.yaxis.set_major_formatter(mtick.PercentFormatter())
 	for scheme in percentages[list(storage.keys())[0]].keys():
@@ -359,11 +221,60 @@ def most_common_rhyme_schemes():
 	fig.set_size_inches(11, 8.5)
 	fig.savefig("output/rhyme_schemes.png")
 
-# frequency_by_group()
-# category_frequency_by_group()
-# most_common_rhymes()
-# sentiment_by_group()
-most_common_rhyme_schemes()
+def meter_by_group(results: Optional[Results] = None):
+	results = results or scan_groups()
+
+	storage = {
+		group: results[group]['meter']
+		for group
+		in decade_groups().keys()
+		if group and group not in ['40s', '50s']
+	}
+
+	percentages = {}
+	for group, meters in storage.items():
+		# Lines too short to have a meter are left out
+		lines = sum(amount for meter, amount in meters.items() if meter) or 1
+		percentages[group] = {meter: amount / lines * 100 for meter, amount in meters.items() if meter}
+	meters = sorted(set(chain.from_iterable(percs.keys() for percs in percentages.values())))
+
+	plt, mtick = pyplot()
+	fig, ax = plt.subplots()
+	ax.yaxis.set_major_formatter(mtick.PercentFormatter())
+	for meter in meters:
+		ax.plot(percentages.keys(), [percs.get(meter, 0) for percs in percentages.values()], label=meter)
+
+	ax.set_title("Meter over time")
+	ax.set_xlabel("Decade")
+	ax.set_ylabel("Percentage of lines")
+	ax.legend()
+
+	fig.set_size_inches(11, 8.5)
+	fig.savefig("output/meter.png")
+
+def all_charts():
+	"""
+	Every chart from a single set of group totals.
+	"""
+	results = scan_groups()
+	matrix = frequency_matrix()
+	frequency_by_group(matrix)
+	category_frequency_by_group(matrix)
+	most_common_rhymes(results)
+	most_common_rhyme_schemes(results)
+	meter_by_group(results)
+
+charts = {
+	'word-frequency': frequency_by_group,
+	'categories': category_frequency_by_group,
+	'rhymes': most_common_rhymes,
+	'rhyme-schemes': most_common_rhyme_schemes,
+	'meter': meter_by_group,
+	'all': all_charts,
+}
+
+if __name__ == '__main__':
+	most_common_rhyme_schemes()
 
 # def gen_sentiment_histogram():
 # 	sentiments = list(chain.from_iterable(stanza_sentiment(stanza) for stanza in stanzas))
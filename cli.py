@@ -0,0 +1,108 @@
+"""
+Entry point for every stage of the project:
+
+	python cli.py scrape
+	python cli.py parse [--batch-sentiment | --staged] [--full] [--dedupe]
+	python cli.py analyse [--count-clusters] <chart>
+	python cli.py dedupe
+	python cli.py serve-phonemizer [--workers N ...]
+	python cli.py warm-phonemes
+	python cli.py build-pronunciations
+	python cli.py import-parsings
+
+Each subcommand imports only what it needs, so e.g. `analyse` never loads
+NLTK's tagger or the phonemizer model, and nothing needs a display.
+"""
+from argparse import ArgumentParser, REMAINDER
+
+CHARTS = ['word-frequency', 'categories', 'rhymes', 'rhyme-schemes', 'meter', 'all']
+
+def scrape(args):
+	from scrape_lyrics import scrape
+	# Unset options keep scrape_lyrics.py's defaults
+	options = {
+		name: getattr(args, name)
+		for name in ("concurrency", "rate", "base_url", "songs_per_csv")
+		if getattr(args, name) is not None
+	}
+	scrape(**options)
+
+def parse(args):
+	from parse_lyrics import parse
+	# Unset pipeline options keep pipeline.py's defaults
+	options = {
+		name: getattr(args, name)
+		for name in ("cpu_workers", "io_concurrency", "batch_songs", "queue_size")
+		if getattr(args, name) is not None
+	}
+	parse(batch_sentiment=args.batch_sentiment, incremental=not args.full, dedupe=args.dedupe, staged=args.staged, **options)
+
+def analyse(args):
+	import analyse_lyrics
+	analyse_lyrics.count_clusters = args.count_clusters
+	analyse_lyrics.charts[args.chart]()
+
+def dedupe(args):
+	from dedupe import find_clusters
+	find_clusters()
+
+def serve_phonemizer(args):
+	import sys
+	import runpy
+
+	sys.argv = ["phonemeizer_server.py", *args.server_args]
+	runpy.run_module("phonemeizer_server", run_name="__main__")
+
+def warm_phonemes(args):
+	from phoneme_cache import warm
+	warm()
+
+def build_pronunciations(args):
+	from pronunciations import build
+	build()
+
+def import_parsings(args):
+	from columns import import_parsings
+	import_parsings()
+
+def main(argv=None):
+	parser = ArgumentParser(description="Phonetic and semantic trends in popular music lyrics.")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+
+	scrape_parser = subparsers.add_parser("scrape", help="download lyrics for the songs in *.csv")
+	scrape_parser.add_argument("--concurrency", type=int, help="requests in flight at once")
+	scrape_parser.add_argument("--rate", type=float, help="requests per second")
+	scrape_parser.add_argument("--base-url", help="lyrics API, e.g. a local stand-in server")
+	scrape_parser.add_argument("--songs-per-csv", type=int)
+	scrape_parser.set_defaults(func=scrape)
+
+	parse_parser = subparsers.add_parser("parse", help="parse downloaded lyrics")
+	parse_parser.add_argument("--batch-sentiment", action="store_true", help="batch sentiment requests across songs")
+	parse_parser.add_argument("--full", action="store_true", help="reparse every song, not just new or changed ones")
+	parse_parser.add_argument("--dedupe", action="store_true", help="only parse one song of every cluster of near-duplicates")
+	parse_parser.add_argument("--staged", action="store_true", help="overlap tagging with batched service requests (see pipeline.py)")
+	parse_parser.add_argument("--cpu-workers", type=int, help="tagging processes with --staged")
+	parse_parser.add_argument("--io-concurrency", type=int, help="service request batches in flight with --staged")
+	parse_parser.add_argument("--batch-songs", type=int, help="songs per service request batch with --staged")
+	parse_parser.add_argument("--queue-size", type=int, help="songs waiting between stages with --staged")
+	parse_parser.set_defaults(func=parse)
+
+	analyse_parser = subparsers.add_parser("analyse", help="render a chart from the parsings")
+	analyse_parser.add_argument("--count-clusters", action="store_true", help="count near-duplicate songs once (run dedupe first)")
+	analyse_parser.add_argument("chart", choices=CHARTS)
+	analyse_parser.set_defaults(func=analyse)
+
+	serve_parser = subparsers.add_parser("serve-phonemizer", help="run the phonemizer server (see phonemeizer_server.py --help)")
+	serve_parser.add_argument("server_args", nargs=REMAINDER)
+	serve_parser.set_defaults(func=serve_phonemizer)
+
+	subparsers.add_parser("dedupe", help="cluster near-duplicate lyrics").set_defaults(func=dedupe)
+	subparsers.add_parser("warm-phonemes", help="phonemize the corpus vocabulary into the phoneme cache").set_defaults(func=warm_phonemes)
+	subparsers.add_parser("build-pronunciations", help="pack the CMU dictionary into cmudict.idx").set_defaults(func=build_pronunciations)
+	subparsers.add_parser("import-parsings", help="load parsings/*.json.gz into the column store").set_defaults(func=import_parsings)
+
+	args = parser.parse_args(argv)
+	args.func(args)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,159 @@
+"""
+A columnar store for parsings. Each field of a parsing lives in its own file
+of JSON lines under parsings/columns/, one line per song, in the same row
+order as ids.txt. Per-stanza values stay lists, so a value's stanza index is
+its position in the list. An analysis that needs one field reads one file
+with a single sequential scan instead of opening and decoding every song.
+
+The store is append-only with a single writer (the parse() parent process).
+Re-parsed songs are appended again and the latest row wins. Convert the
+older one-gzipped-file-per-song parsings with:
+	python columns.py import
+"""
+from pathlib import Path
+from itertools import chain, islice, repeat
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import json
+import mmap
+import os
+
+COLUMNS = ("freqs", "rhymes", "rhyme_structure", "sentiment", "stress")
+DEFAULT_PATH = Path.cwd() / "parsings" / "columns"
+
+def read_lines(path: Path) -> Iterator[bytes]:
+	if not path.exists():
+		return
+	with open(path, "rb") as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+			yield from iter(m.readline, b"")
+
+def truncate_lines(path: Path, count: int):
+	"""
+	Cut `path` down to its first `count` lines, dropping a partially
+	appended row left behind by a crash. A column added after rows were
+	written is padded with nulls up to `count` instead.
+	"""
+	offset = 0
+	lines = 0
+	for line in read_lines(path):
+		if lines == count:
+			break
+		offset += len(line)
+		lines += 1
+	if path.exists() and offset < path.stat().st_size:
+		with open(path, "r+b") as f:
+			f.truncate(offset)
+	elif lines < count:
+		with open(path, "ab") as f:
+			f.write(b"null\n" * (count - lines))
+
+class ColumnStore:
+	path: Path
+
+	def __init__(self, path: Path = DEFAULT_PATH):
+		self.path = path
+		self._files = None
+		self._ids: Optional[List[str]] = None
+
+	def column_path(self, column: str) -> Path:
+		return self.path / f"{column}.jsonl"
+
+	def column_lines(self, column: str) -> Iterator[bytes]:
+		# Rows from before a column existed read as null
+		return chain(read_lines(self.column_path(column)), repeat(b"null"))
+
+	@property
+	def ids_path(self) -> Path:
+		return self.path / "ids.txt"
+
+	def ids(self) -> List[str]:
+		"""
+		Song id of every committed row, including superseded ones.
+		"""
+		if self._ids is None:
+			self._ids = [line.rstrip(b"\n").decode() for line in read_lines(self.ids_path)]
+		return self._ids
+
+	def id_set(self) -> Set[str]:
+		return set(self.ids())
+
+	def latest_rows(self) -> Dict[str, int]:
+		return {song_id: row for row, song_id in enumerate(self.ids())}
+
+	def append(self, parsing: dict):
+		if self._files is None:
+			self.path.mkdir(parents=True, exist_ok=True)
+			committed = len(self.ids())
+			for column in COLUMNS:
+				truncate_lines(self.column_path(column), committed)
+			self._files = {column: open(self.column_path(column), "ab") for column in COLUMNS}
+			self._files['id'] = open(self.ids_path, "ab")
+
+		for column in COLUMNS:
+			self._files[column].write(json.dumps(parsing.get(column), separators=(",", ":")).encode() + b"\n")
+			self._files[column].flush()
+		# ids.txt is written last; a row only exists once its id does
+		self._files['id'].write(parsing['id'].encode() + b"\n")
+		self._files['id'].flush()
+		self.ids().append(parsing['id'])
+
+	def scan(self, *columns: str, ids: Optional[Iterable[str]] = None, decode: bool = True) -> Iterator[Tuple]:
+		"""
+		Yield (song id, *values) for the latest row of every song, or only of
+		the songs in `ids`. Rows that are skipped are never decoded; with
+		`decode=False` values are returned as raw JSON bytes.
+		"""
+		wanted = set(ids) if ids is not None else None
+		latest = self.latest_rows()
+		readers = [self.column_lines(column) for column in columns]
+
+		for row, (song_id, *values) in enumerate(zip(self.ids(), *readers)):
+			if latest[song_id] != row or (wanted is not None and song_id not in wanted):
+				continue
+			yield (song_id, *(json.loads(value) if decode else value for value in values))
+
+	def scan_rows(self, *columns: str, start: int = 0, decode: bool = True) -> Iterator[Tuple]:
+		"""
+		Yield (row, song id, *values) for every committed row from `start` on,
+		superseded rows included.
+		"""
+		readers = [islice(self.column_lines(column), start, None) for column in columns]
+		for row, (song_id, *values) in enumerate(zip(self.ids()[start:], *readers), start):
+			yield (row, song_id, *(json.loads(value) if decode else value for value in values))
+
+	def close(self):
+		if self._files is not None:
+			for f in self._files.values():
+				f.close()
+			self._files = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def import_parsings(parsings_dir: Path = Path.cwd() / "parsings"):
+	import gzip
+
+	with ColumnStore() as store:
+		existing = store.id_set()
+		for index, path in enumerate(parsings_dir.glob("*.json.gz")):
+			if path.name.removesuffix(".json.gz") in existing:
+				continue
+			with gzip.open(path, "rt", encoding="utf-8") as f:
+				store.append(json.load(f))
+			print(index)
+
+	print("Done!")
+
+if __name__ == '__main__':
+	import sys
+
+	if sys.argv[1:] == ["import"]:
+		import_parsings()
+	else:
+		store = ColumnStore()
+		print(len(store.latest_rows()), "songs in", store.path)
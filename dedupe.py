@@ -0,0 +1,191 @@
+"""
+Near-duplicate detection for the downloaded lyrics. Remasters, deluxe
+editions and radio edits of a song have (almost) the same lyrics, so every
+lyrics/*.json gets a MinHash signature of its word 3-grams, and an LSH index
+over signature bands finds the candidate pairs. Candidates whose signatures
+agree on at least THRESHOLD of their hashes are clustered, and each cluster
+is represented by its smallest song id.
+
+Signatures are cached in parsings/minhash.npz and only recomputed for files
+that changed. Compute the clusters with:
+	python dedupe.py
+"""
+from collections import defaultdict
+from itertools import combinations
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+import json
+import re
+import zlib
+import numpy as np
+
+NUM_PERM = 128
+# 16 bands of 8 rows: a pair shares a band with probability 1 - (1 - s^8)^16,
+# about 0.95 at the 0.8 THRESHOLD but only 0.61 at 0.7 similarity
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+
+MERSENNE_PRIME = (1 << 31) - 1
+EMPTY = np.iinfo(np.uint32).max
+DEFAULT_PATH = Path.cwd() / "parsings" / "minhash.npz"
+CLUSTERS_PATH = Path.cwd() / "parsings" / "clusters.json"
+
+# Fixed seed, so signatures stay comparable between runs
+_random = np.random.default_rng(1)
+_a = _random.integers(1, MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+_b = _random.integers(0, MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+
+def shingles(path: Path) -> Set[int]:
+	with open(path) as f:
+		words = re.findall(r"\w+", " ".join(line['words'] for line in json.load(f)['lines']).lower())
+	return {
+		zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode())
+		for i in range(max(len(words) - SHINGLE_SIZE + 1, 1 if words else 0))
+	}
+
+def signature(path: Path) -> np.ndarray:
+	hashes = np.fromiter(shingles(path), dtype=np.uint64)
+	if not len(hashes):
+		return np.full(NUM_PERM, EMPTY, dtype=np.uint32)
+	# One universal hash per permutation: (a * x + b) mod p, minimum over shingles
+	permuted = (np.outer(hashes % MERSENNE_PRIME, _a) + _b) % MERSENNE_PRIME
+	return permuted.min(axis=0).astype(np.uint32)
+
+def _stamp(path: Path) -> Tuple[int, int]:
+	stat = path.stat()
+	return stat.st_size, stat.st_mtime_ns
+
+class Signatures:
+	"""
+	MinHash signatures of the lyrics files, one row per song id.
+	"""
+	ids: List[str]
+	stamps: np.ndarray
+	signatures: np.ndarray
+
+	def __init__(self, ids: List[str], stamps: np.ndarray, signatures: np.ndarray):
+		self.ids = ids
+		self.stamps = stamps
+		self.signatures = signatures
+
+	@classmethod
+	def load(cls, path: Path = DEFAULT_PATH) -> "Signatures":
+		if not path.exists():
+			return cls([], np.empty((0, 2), dtype=np.int64), np.empty((0, NUM_PERM), dtype=np.uint32))
+		with np.load(path, allow_pickle=False) as f:
+			return cls(f['ids'].tolist(), f['stamps'], f['signatures'])
+
+	def save(self, path: Path = DEFAULT_PATH):
+		path.parent.mkdir(parents=True, exist_ok=True)
+		np.savez(path, ids=np.array(self.ids, dtype=str), stamps=self.stamps, signatures=self.signatures)
+
+	def update(self, lyrics_dir: Path) -> int:
+		"""
+		Sign new and changed files and forget deleted ones. Returns the number
+		of files signed.
+		"""
+		paths = {path.stem: path for path in lyrics_dir.glob("*.json")}
+		stamps = {song_id: _stamp(path) for song_id, path in paths.items()}
+		rows = {song_id: row for row, song_id in enumerate(self.ids)}
+
+		keep = [
+			rows[song_id]
+			for song_id in paths
+			if song_id in rows and tuple(self.stamps[rows[song_id]]) == stamps[song_id]
+		]
+		kept = {self.ids[row] for row in keep}
+		changed = [song_id for song_id in paths if song_id not in kept]
+
+		with Pool() as p:
+			signed = p.map(signature, [paths[song_id] for song_id in changed], chunksize=64)
+
+		self.ids = [self.ids[row] for row in keep] + changed
+		self.stamps = np.concatenate([self.stamps[keep], np.array([stamps[song_id] for song_id in changed], dtype=np.int64).reshape(-1, 2)])
+		self.signatures = np.concatenate([self.signatures[keep], np.array(signed, dtype=np.uint32).reshape(-1, NUM_PERM)])
+		return len(changed)
+
+	def candidates(self) -> Iterable[Tuple[int, int]]:
+		"""
+		Row pairs that share at least one band of their signatures.
+		"""
+		signed = np.flatnonzero((self.signatures != EMPTY).any(axis=1))
+		for band in range(BANDS):
+			buckets = defaultdict(list)
+			band_rows = self.signatures[:, band * ROWS:(band + 1) * ROWS]
+			for row in signed:
+				buckets[band_rows[row].tobytes()].append(row)
+			for bucket in buckets.values():
+				yield from combinations(bucket, 2)
+
+	def clusters(self, threshold: float = THRESHOLD) -> List[List[str]]:
+		"""
+		Groups of at least two near-duplicate songs, each sorted by id.
+		"""
+		parent = list(range(len(self.ids)))
+
+		def find(row: int) -> int:
+			while parent[row] != row:
+				parent[row] = parent[parent[row]]
+				row = parent[row]
+			return row
+
+		for first, second in self.candidates():
+			root_first, root_second = find(first), find(second)
+			if root_first == root_second:
+				continue
+			if np.mean(self.signatures[first] == self.signatures[second]) >= threshold:
+				parent[root_second] = root_first
+
+		members = defaultdict(list)
+		for row, song_id in enumerate(self.ids):
+			members[find(row)].append(song_id)
+		return [sorted(cluster) for cluster in members.values() if len(cluster) > 1]
+
+def find_clusters(lyrics_dir: Path = Path.cwd() / "lyrics", threshold: float = THRESHOLD) -> Dict[str, str]:
+	"""
+	Update the signatures and cluster them. Returns song id -> representative
+	for every song in a cluster of near-duplicates, and saves it for
+	load_clusters.
+	"""
+	signatures = Signatures.load()
+	signed = signatures.update(lyrics_dir)
+	signatures.save()
+
+	clusters = signatures.clusters(threshold)
+	representatives = {song_id: cluster[0] for cluster in clusters for song_id in cluster}
+	CLUSTERS_PATH.write_text(json.dumps(representatives))
+
+	print(
+		signed, "signed,", len(signatures.ids), "songs,",
+		len(clusters), "clusters of", len(representatives), "near-duplicates",
+	)
+	return representatives
+
+def load_clusters() -> Dict[str, str]:
+	if not CLUSTERS_PATH.exists():
+		return {}
+	return json.loads(CLUSTERS_PATH.read_text())
+
+def is_representative(song_id: str, representatives: Dict[str, str]) -> bool:
+	return representatives.get(song_id, song_id) == song_id
+
+def collapse(groups: Dict[str, Set[str]], representatives: Dict[str, str], undated: str = '') -> Dict[str, Set[str]]:
+	"""
+	Count every cluster once: its members are replaced by its representative,
+	which only stays in the first group (the earliest one for chronological
+	groups) any member appears in. The `undated` group only keeps clusters
+	without a dated member, even though it comes first.
+	"""
+	seen = set()
+	collapsed = {}
+	for group in sorted(groups, key=lambda group: group == undated):
+		clusters = {representatives.get(track_id, track_id) for track_id in groups[group]}
+		collapsed[group] = clusters - seen
+		seen |= clusters
+	return {group: collapsed[group] for group in groups}
+
+if __name__ == '__main__':
+	find_clusters()
@@ -0,0 +1,151 @@
+"""
+panphon's segment features, precompiled into a NumPy table. The table is
+built once from panphon.FeatureTable and cached in ipa_features.npz. After
+that, segmenting the small IPA alphabet the phonemizer emits is a greedy
+dictionary walk, and feature queries are array lookups.
+"""
+from functools import cache, lru_cache
+from os import environ
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+
+DEFAULT_PATH = Path.cwd() / "ipa_features.npz"
+SEGMENT_CACHE_SIZE = int(environ.get("SEGMENT_CACHE_SIZE", 100_000))
+
+PRIMARY_STRESS = 'ˈ'
+SECONDARY_STRESS = 'ˌ'
+LENGTH = 'ː'
+# Symbols panphon doesn't know, spelled the way it does
+ALIASES = {'ɝ': 'ɜ˞', 'ɚ': 'ə˞', 'g': 'ɡ'}
+
+class Segmentation(NamedTuple):
+	# Index of each segment in SegmentTable.segments
+	ids: np.ndarray
+	# Offset of each segment in the IPA string
+	starts: np.ndarray
+	# Stress mark right before each segment: 0 none, 1 primary, 2 secondary
+	stress: np.ndarray
+
+class SegmentTable:
+	segments: List[str]
+	index: Dict[str, int]
+	names: List[str]
+	# segments x features, each -1, 0 or +1
+	features: np.ndarray
+
+	def __init__(self, segments: List[str], names: List[str], features: np.ndarray, cache_size: Optional[int] = SEGMENT_CACHE_SIZE):
+		self.segments = segments
+		self.names = names
+		self.features = features
+		self.index = {segment: index for index, segment in enumerate(segments)}
+		for alias, segment in ALIASES.items():
+			if segment in self.index:
+				self.index.setdefault(alias, self.index[segment])
+		self.max_length = max(map(len, self.index))
+		self.syllabic = features[:, names.index('syl')] == 1
+		self.long = features[:, names.index('long')] == 1
+		# Words repeat endlessly in lyrics, so segmentations are memoized
+		self.segment = lru_cache(maxsize=cache_size)(self.segment)
+
+	@classmethod
+	def build(cls) -> "SegmentTable":
+		from panphon import FeatureTable
+
+		ft = FeatureTable()
+		segments = list(ft.seg_dict.keys())
+		features = np.array([ft.seg_dict[segment].numeric() for segment in segments], dtype=np.int8)
+		return cls(segments, list(ft.names), features)
+
+	@classmethod
+	def load(cls, path: Path = DEFAULT_PATH) -> "SegmentTable":
+		if path.exists():
+			with np.load(path, allow_pickle=False) as f:
+				return cls(list(f['segments']), list(f['names']), f['features'])
+
+		table = cls.build()
+		np.savez(path, segments=np.array(table.segments), names=np.array(table.names), features=table.features)
+		return table
+
+	def feature(self, name: str) -> np.ndarray:
+		return self.features[:, self.names.index(name)]
+
+	def segment(self, ipa: str) -> Segmentation:
+		"""
+		Greedy longest-match segmentation. Stress marks are attached to the
+		segment after them; anything panphon doesn't know is skipped.
+		"""
+		ids = []
+		starts = []
+		stress = []
+		pending_stress = 0
+		position = 0
+
+		while position < len(ipa):
+			symbol = ipa[position]
+			if symbol == PRIMARY_STRESS or symbol == SECONDARY_STRESS:
+				pending_stress = 1 if symbol == PRIMARY_STRESS else 2
+				position += 1
+				continue
+
+			for length in range(min(self.max_length, len(ipa) - position), 0, -1):
+				if (segment_id := self.index.get(ipa[position:position + length])) is not None:
+					ids.append(segment_id)
+					starts.append(position)
+					stress.append(pending_stress)
+					pending_stress = 0
+					position += length
+					break
+			else:
+				position += 1
+
+		return Segmentation(np.array(ids, dtype=np.int32), np.array(starts, dtype=np.int32), np.array(stress, dtype=np.int8))
+
+	def nuclei(self, segmentation: Segmentation) -> np.ndarray:
+		"""
+		Mask of the segments starting a syllable nucleus. Runs of syllabic
+		segments (diphthongs) form one nucleus.
+		"""
+		syllabic = self.syllabic[segmentation.ids]
+		return syllabic & ~np.concatenate(([False], syllabic[:-1]))
+
+	def last_syllabic_start(self, ipa: str) -> Optional[int]:
+		"""
+		Offset in `ipa` of its last syllable nucleus.
+		"""
+		segmentation = self.segment(ipa)
+		nuclei = np.flatnonzero(self.nuclei(segmentation))
+		return int(segmentation.starts[nuclei[-1]]) if len(nuclei) else None
+
+	def stress_pattern(self, ipa: str) -> List[bool]:
+		"""
+		Whether each syllable of a word is stressed. A syllable is stressed if
+		a stress mark precedes its nucleus or the nucleus is long.
+		"""
+		segmentation = self.segment(ipa)
+		syllabic = self.syllabic[segmentation.ids]
+		if not syllabic.any():
+			return []
+
+		starts = self.nuclei(segmentation)
+		nucleus_starts = np.flatnonzero(starts)
+		# Stress marks may sit before the onset too; credit them to the next nucleus
+		marked = np.flatnonzero(segmentation.stress)
+		stressed = np.zeros(len(nucleus_starts), dtype=bool)
+		if len(marked):
+			stressed[np.minimum(np.searchsorted(nucleus_starts, marked), len(nucleus_starts) - 1)] = True
+
+		nucleus_ids = np.cumsum(starts) - 1
+		long_nuclei = nucleus_ids[syllabic & self.long[segmentation.ids]]
+		stressed[long_nuclei] = True
+		# Length marks written as a separate symbol
+		for index, start in enumerate(nucleus_starts):
+			end = segmentation.starts[nucleus_starts[index + 1]] if index + 1 < len(nucleus_starts) else len(ipa)
+			if LENGTH in ipa[segmentation.starts[start]:end]:
+				stressed[index] = True
+
+		return stressed.tolist()
+
+@cache
+def table() -> SegmentTable:
+	return SegmentTable.load()
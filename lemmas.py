@@ -0,0 +1,76 @@
+"""
+WordNet lemmatization behind a bounded LRU keyed on (token, POS). Lyrics
+repeat the same few hundred words endlessly, so almost every lookup is a hit.
+
+Set LEMMA_CACHE to a file path to keep the cache between runs.
+"""
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import json
+import os
+from lru import LRUCache
+
+LEMMA_CACHE_SIZE = int(os.environ.get("LEMMA_CACHE_SIZE", 200_000))
+LEMMA_CACHE = Path(os.environ["LEMMA_CACHE"]) if os.environ.get("LEMMA_CACHE") else None
+
+class CachedLemmatizer:
+	cache: LRUCache[Tuple[str, str], str]
+
+	def __init__(self, maxsize: Optional[int] = LEMMA_CACHE_SIZE, path: Optional[Path] = LEMMA_CACHE):
+		self.cache = LRUCache(maxsize)
+		self.path = path
+		self._lemmatizer = None
+
+		if path is not None and path.exists():
+			self.cache.update(self.load(path).items())
+
+	def lemmatize(self, word: str, pos: str = "n") -> str:
+		key = (word, pos)
+		if (lemma := self.cache.get(key)) is None:
+			if self._lemmatizer is None:
+				from nltk.stem import WordNetLemmatizer
+				self._lemmatizer = WordNetLemmatizer()
+			lemma = self._lemmatizer.lemmatize(word, pos)
+			self.cache.put(key, lemma)
+		return lemma
+
+	def info(self) -> Dict[str, Optional[int]]:
+		return self.cache.info()
+
+	@staticmethod
+	def load(path: Path) -> Dict[Tuple[str, str], str]:
+		try:
+			with open(path, encoding="utf-8") as f:
+				return {(word, pos): lemma for word, pos, lemma in json.load(f)}
+		except (OSError, ValueError):
+			return {}
+
+	def save(self, path: Optional[Path] = None):
+		"""
+		Merge this process' cache into the file at `path`. Concurrent savers
+		may drop each other's new entries, which only costs a lookup later.
+		"""
+		path = path or self.path
+		if path is None:
+			return
+
+		merged = self.load(path)
+		merged.update(self.cache.items())
+		entries = [[word, pos, lemma] for (word, pos), lemma in merged.items()]
+		if self.cache.maxsize is not None:
+			entries = entries[-self.cache.maxsize:]
+
+		temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+		with open(temporary, "w", encoding="utf-8") as f:
+			json.dump(entries, f)
+		os.replace(temporary, path)
+
+lemmatizer = CachedLemmatizer()
+
+def save_on_exit():
+	"""
+	Pool initializer that persists each worker's cache when it exits cleanly
+	(after Pool.close() and Pool.join()).
+	"""
+	from multiprocessing.util import Finalize
+	Finalize(lemmatizer, lemmatizer.save, exitpriority=10)
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Iterable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class LRUCache(Generic[K, V]):
+	"""
+	A bounded in-memory mapping that evicts the least recently used entry
+	once it holds more than `maxsize` items. A `maxsize` of None never evicts.
+	"""
+	maxsize: Optional[int]
+	hits: int
+	misses: int
+
+	def __init__(self, maxsize: Optional[int] = 100_000):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._data: "OrderedDict[K, V]" = OrderedDict()
+
+	def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+		try:
+			value = self._data[key]
+		except KeyError:
+			self.misses += 1
+			return default
+		self._data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def put(self, key: K, value: V):
+		self._data[key] = value
+		self._data.move_to_end(key)
+		if self.maxsize is not None:
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def update(self, items: Iterable[Tuple[K, V]]):
+		for key, value in items:
+			self.put(key, value)
+
+	def items(self):
+		return self._data.items()
+
+	def clear(self):
+		self._data.clear()
+		self.hits = 0
+		self.misses = 0
+
+	def info(self) -> Dict[str, Optional[int]]:
+		return dict(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize)
+
+	def __contains__(self, key: K) -> bool:
+		return key in self._data
+
+	def __len__(self) -> int:
+		return len(self._data)
@@ -0,0 +1,98 @@
+"""
+Tracks which songs in lyrics/ have been parsed, from which version of their
+lyrics and by which version of the analysis, so parse() can dispatch only new
+or changed songs.
+
+The manifest is an append-only log of JSON lines in parsings/manifest.jsonl;
+the last entry for a song wins.
+"""
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+import json
+import os
+
+class Entry(NamedTuple):
+	size: int
+	mtime_ns: int
+	sha1: str
+	version: int
+
+def file_digest(path: Path) -> str:
+	return sha1(path.read_bytes()).hexdigest()
+
+class Manifest:
+	path: Path
+	entries: Dict[str, Entry]
+
+	def __init__(self, path: Path = Path.cwd() / "parsings" / "manifest.jsonl"):
+		self.path = path
+		self.entries = {}
+
+		if path.exists():
+			with open(path, encoding="utf-8") as f:
+				for line in f:
+					# A crash can leave a truncated last line behind
+					try:
+						record = json.loads(line)
+					except json.JSONDecodeError:
+						continue
+					song_id = record.pop('id')
+					self.entries[song_id] = Entry(**record)
+
+		self._log = None
+
+	def record(self, song_id: str, path: Path, version: int, digest: Optional[str] = None):
+		stat = path.stat()
+		entry = Entry(stat.st_size, stat.st_mtime_ns, digest or file_digest(path), version)
+		self.entries[song_id] = entry
+
+		if self._log is None:
+			self._log = open(self.path, "a", encoding="utf-8")
+		self._log.write(json.dumps(dict(id=song_id, **entry._asdict())) + "\n")
+		self._log.flush()
+
+	def is_current(self, song_id: str, path: Path, stat: os.stat_result, version: int) -> bool:
+		entry = self.entries.get(song_id)
+		if entry is None or entry.version != version:
+			return False
+		if entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+			return True
+
+		# Touched but maybe not changed; only then is it worth hashing
+		digest = file_digest(path)
+		if digest != entry.sha1:
+			return False
+		self.record(song_id, path, version, digest)
+		return True
+
+	def pending(self, lyrics_dir: Path, version: int) -> List[Path]:
+		"""
+		Songs in `lyrics_dir` without a current parsing. Parsings the manifest
+		doesn't know about, such as imported ones, can't be trusted to match
+		`version` or the lyrics on disk, so their songs are pending too.
+		"""
+		pending = []
+
+		for entry in os.scandir(lyrics_dir):
+			if not entry.name.endswith(".json"):
+				continue
+
+			song_id = entry.name.removesuffix(".json")
+			path = Path(entry.path)
+
+			if not self.is_current(song_id, path, entry.stat(), version):
+				pending.append(path)
+
+		return pending
+
+	def close(self):
+		if self._log is not None:
+			self._log.close()
+			self._log = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
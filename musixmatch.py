@@ -1,24 +1,134 @@
+"""
+Client and crawler for the Musixmatch API.
+
+	python musixmatch.py [artist chart pages]
+
+crawls the US artist chart -> albums -> tracks -> lyrics with a bounded pool
+of threads. Every list is paginated, API calls are rate-limited and counted
+against a daily quota, and responses are cached in musixmatch.sqlite for
+CACHE_TTL so a re-run only fetches what changed. Lyrics are written to
+lyrics/mxm-<track id>.json in the same format as the Spotify lyrics, so
+parse_lyrics can read them.
+"""
 from dotenv import load_dotenv; load_dotenv()
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from os import environ
+from pathlib import Path
 from requests import Session
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from time import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import json
+import sqlite3
+from ratelimit import TokenBucket
 
 key = environ['MUSIXMATCH_API_KEY']
 
 BASE_URL = "https://api.musixmatch.com/ws/1.1/"
+# Seconds a cached response stays fresh
+CACHE_TTL = 7 * 24 * 60 * 60
+# Calls per second and per day; the free plan allows 2000 a day
+RATE = 5.0
+DAILY_QUOTA = int(environ.get("MUSIXMATCH_DAILY_QUOTA", 2000))
+WORKERS = 8
+# Musixmatch lyrics have no timings; fake them so parse_lyrics' gap-based
+# stanza detection splits where the blank lines are
+LINE_MS = 3000
+STANZA_GAP_MS = 15000
+
+class MusixmatchError(Exception):
+	def __init__(self, path: str, status_code: int):
+		super().__init__(f"{path} returned status {status_code}")
+		self.status_code = status_code
+
+class QuotaExceeded(Exception):
+	pass
+
+class ResponseCache:
+	"""
+	API response bodies keyed by (path, params), plus the daily call count and
+	the last seen update time of every crawled track.
+	"""
+	def __init__(self, path: Path = Path.cwd() / "musixmatch.sqlite", ttl: float = CACHE_TTL):
+		self.ttl = ttl
+		self.lock = Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.executescript("""
+			CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, fetched REAL NOT NULL, body TEXT NOT NULL);
+			CREATE TABLE IF NOT EXISTS quota (day TEXT PRIMARY KEY, calls INTEGER NOT NULL);
+			CREATE TABLE IF NOT EXISTS tracks (track_id TEXT PRIMARY KEY, updated_time TEXT NOT NULL);
+		""")
+
+	@staticmethod
+	def key(path: str, params: Dict[str, Any]) -> str:
+		return path + "?" + json.dumps(params, sort_keys=True)
+
+	def get(self, path: str, params: Dict[str, Any]) -> Optional[Any]:
+		with self.lock:
+			row = self.connection.execute("SELECT fetched, body FROM responses WHERE key = ?", (self.key(path, params),)).fetchone()
+		if row and time() - row[0] < self.ttl:
+			return json.loads(row[1])
+		return None
+
+	def put(self, path: str, params: Dict[str, Any], body: Any):
+		with self.lock:
+			self.connection.execute(
+				"INSERT OR REPLACE INTO responses (key, fetched, body) VALUES (?, ?, ?)",
+				(self.key(path, params), time(), json.dumps(body)),
+			)
+			self.connection.commit()
+
+	def count_call(self, quota: int):
+		"""
+		Count an API call against today's quota; raises QuotaExceeded once it's used up.
+		"""
+		today = date.today().isoformat()
+		with self.lock:
+			row = self.connection.execute("SELECT calls FROM quota WHERE day = ?", (today,)).fetchone()
+			calls = row[0] if row else 0
+			if calls >= quota:
+				raise QuotaExceeded(f"{calls} calls made today")
+			self.connection.execute("INSERT OR REPLACE INTO quota (day, calls) VALUES (?, ?)", (today, calls + 1))
+			self.connection.commit()
+
+	def track_changed(self, track_id: str, updated_time: str) -> bool:
+		with self.lock:
+			row = self.connection.execute("SELECT updated_time FROM tracks WHERE track_id = ?", (track_id,)).fetchone()
+		return row is None or row[0] != updated_time
+
+	def track_seen(self, track_id: str, updated_time: str):
+		with self.lock:
+			self.connection.execute("INSERT OR REPLACE INTO tracks (track_id, updated_time) VALUES (?, ?)", (track_id, updated_time))
+			self.connection.commit()
 
 class Musixmatch:
 	session: Session
 
-	def __init__(self):
+	def __init__(self, cache: Optional[ResponseCache] = None, rate: float = RATE, quota: int = DAILY_QUOTA, workers: int = WORKERS):
 		self.session = Session()
+		self.session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+		self.cache = cache
+		self.bucket = TokenBucket(rate)
+		self.quota = quota
 
 	def call_api(self, path: str, **kwargs):
+		if self.cache and (body := self.cache.get(path, kwargs)) is not None:
+			return body
+
+		if self.cache:
+			self.cache.count_call(self.quota)
+		self.bucket.acquire()
 		res = self.session.get(BASE_URL + path, params=dict(apikey=key, **kwargs))
 		res.raise_for_status()
 
 		message = res.json()['message']
-		assert message['header']['status_code'] == 200
+		if message['header']['status_code'] != 200:
+			raise MusixmatchError(path, message['header']['status_code'])
+
+		if self.cache:
+			self.cache.put(path, kwargs, message['body'])
 		return message['body']
 	
 	def chart_artists_get(self, country: str = 'us', page: int = 1, page_size: int = 100):
@@ -37,25 +147,87 @@ class Musixmatch:
 		body = self.call_api("track.lyrics.get", track_id=track_id, page=page, page_size=page_size)
 		return body['lyrics']
 
-if __name__ == '__main__':
-	from pprint import pprint as print
-
-	api = Musixmatch()
-	# for i in range
-	top_artists = api.chart_artists_get()
-	for artist in top_artists:
-		artist = artist['artist']
-		print(artist['artist_name'])
-		albums = api.artists_albums_get(artist['artist_id'])
-		for album in albums:
-			album = album['album']
-			print(album['album_name'])
-			tracks = api.album_tracks_get(album['album_id'])
-			for track in tracks:
-				track = track['track']
-				print(track['track_name'])
-				lyrics = api.track_lyrics_get(track['track_id'])
-				print(lyrics['lyrics_body'])
-				break
+def paginate(method: Callable[..., List[dict]], *args, page_size: int = 100, max_pages: Optional[int] = None, **kwargs) -> Iterator[dict]:
+	"""
+	Yield every item of a paginated list method, fetching pages until one
+	comes back short.
+	"""
+	page = 1
+	while max_pages is None or page <= max_pages:
+		items = method(*args, page=page, page_size=page_size, **kwargs)
+		yield from items
+		if len(items) < page_size:
+			break
+		page += 1
 
+def to_spotify_lyrics(lyrics_body: str) -> dict:
+	"""
+	Convert a Musixmatch lyrics body to the lyrics/ JSON format.
+	"""
+	lines = []
+	time_ms = 0
+	for text in lyrics_body.splitlines():
+		text = text.strip()
+		# Free plan bodies end with a disclaimer and a tracking number
+		if text.startswith("*******") or (text.startswith("(") and text[1:-1].isdigit()):
+			break
+		if not text:
+			time_ms += STANZA_GAP_MS
+			continue
+		lines.append(dict(startTimeMs=str(time_ms), words=text))
+		time_ms += LINE_MS
+
+	return dict(error=False, syncType="UNSYNCED", lines=lines)
+
+def crawl(artist_pages: int = 1, workers: int = WORKERS, lyrics_dir: Path = Path.cwd() / "lyrics"):
+	lyrics_dir.mkdir(exist_ok=True)
+	cache = ResponseCache()
+	api = Musixmatch(cache, workers=workers)
+
+	def albums(artist: dict) -> List[dict]:
+		return [album['album'] for album in paginate(api.artists_albums_get, artist['artist_id'])]
+
+	def tracks(album: dict) -> List[dict]:
+		return [track['track'] for track in paginate(api.album_tracks_get, album['album_id'])]
+
+	def lyrics(track: dict) -> Optional[str]:
+		track_id = str(track['track_id'])
+		file = lyrics_dir / f"mxm-{track_id}.json"
+		if file.exists() and not cache.track_changed(track_id, track['updated_time']):
+			return None
+
+		try:
+			body = api.track_lyrics_get(track_id)
+		except MusixmatchError as e:
+			# E.g. lyrics restricted in this region; only QuotaExceeded stops the crawl
+			print(track['track_name'], "-- skipping:", e)
+			return None
+		temporary = file.with_name(f".{file.name}.tmp")
+		temporary.write_text(json.dumps(to_spotify_lyrics(body['lyrics_body'])))
+		temporary.replace(file)
+		cache.track_seen(track_id, track['updated_time'])
+		return track['track_name']
+
+	try:
+		artists = [artist['artist'] for artist in paginate(api.chart_artists_get, max_pages=artist_pages)]
+		print(len(artists), "artists")
+
+		with ThreadPoolExecutor(workers) as executor:
+			all_albums = [album for artist_albums in executor.map(albums, artists) for album in artist_albums]
+			print(len(all_albums), "albums")
+
+			all_tracks = [track for album_tracks in executor.map(tracks, all_albums) for track in album_tracks if track['has_lyrics']]
+			print(len(all_tracks), "tracks with lyrics")
+
+			for index, name in enumerate(executor.map(lyrics, all_tracks)):
+				if name:
+					print(index, name)
+	except QuotaExceeded as e:
+		print("Daily quota used up:", e)
+
+	print("Done!")
+
+if __name__ == '__main__':
+	import sys
 
+	crawl(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -1,26 +1,38 @@
 from collections import Counter
 from datetime import timedelta
-from difflib import SequenceMatcher
 from itertools import combinations, pairwise, chain
 import json
+import os
 import re
 from statistics import mean, median
-from typing import List, NamedTuple, Optional, Tuple, Set, Dict
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Set, Dict
 import nltk
-from panphon import FeatureTable
+from lemmas import lemmatizer
+import lemmas
 from pathlib import Path
 from multiprocessing import Pool
-import requests
+import services
 import logging
-import gzip
+from phoneme_cache import shared_cache
+import stanza_cache
+from hashlib import sha1
+from pronunciations import shared_dict
+from manifest import Manifest
+from columns import ColumnStore
+from aggregates import AggregateStore
+from functools import partial
+from operator import attrgetter
+import ipa
+import scheduling
+from utils import per_process
 logging.disable(logging.CRITICAL)
 
-ft = FeatureTable()
-
-lemmatizer = nltk.wordnet.WordNetLemmatizer()
 # https://stackoverflow.com/questions/33587667/extracting-all-nouns-from-a-text-file-using-nltk
 noun_tags = {"NN", "NNP", "NNS", "NNPS"}
 
+# Bump whenever the contents of a parsing change so old ones get redone
+ANALYSIS_VERSION = 5
+
 class SpotifyLine(NamedTuple):
 	start_time: timedelta
 	text: str
@@ -31,10 +43,15 @@ class Line:
 	# text sans adlib
 	line: str
 	adlib: Optional[str]
+	# (token, Penn Treebank tag) pairs, filled in once per song by tag_song
+	tagged: Optional[List[Tuple[str, str]]]
+	adlib_tagged: Optional[List[Tuple[str, str]]]
 
 	def __init__(self, line_no: int, text: str):
 		self.line_no = line_no
 		self.text = text
+		self.tagged = None
+		self.adlib_tagged = None
 
 		original_adlib = Line.find_adlib(text)
 		self.adlib = original_adlib.strip() if original_adlib else None
@@ -56,9 +73,39 @@ class Rhyme(NamedTuple):
 	word_b: str
 	line_b: Line
 	suffix: Tuple[str, ...]
+	# Shared rhyme key (see rhyme_key) of both words
+	key: str
+
+TaggedLine = List[Tuple[str, str]]
+
+@per_process
+def tagger() -> nltk.tag.PerceptronTagger:
+	# nltk.pos_tag_sents loads the model from disk on every call
+	return nltk.tag.PerceptronTagger()
+
+def tag_song(stanzas: Stanzas):
+	"""
+	Tokenize and tag every untagged line and adlib of a song in one tag_sents
+	call, storing the results on the lines for every analysis to share.
+	"""
+	lines = [line for stanza in stanzas for line in stanza if line.tagged is None]
+	if not lines:
+		return
+	adlib_lines = [line for line in lines if line.adlib]
+
+	tagged = tagger().tag_sents(
+		[nltk.word_tokenize(line.line) for line in lines]
+		+ [nltk.word_tokenize(line.adlib) for line in adlib_lines]
+	)
+
+	for line, tagged_line in zip(lines, tagged):
+		line.tagged = tagged_line
+	for line, tagged_adlib in zip(adlib_lines, tagged[len(lines):]):
+		line.adlib_tagged = tagged_adlib
 
-def tag_stanza(stanza: List[Line]):
-	return (nltk.pos_tag(nltk.word_tokenize(line.line)) for line in stanza)
+def tag_stanza(stanza: List[Line]) -> List[TaggedLine]:
+	tag_song([stanza])
+	return [line.tagged for line in stanza]
 
 def extract_nouns(stanza: List[Line]) -> set[str]:
 	tagged_lines = tag_stanza(stanza)
@@ -127,13 +174,81 @@ def extract_nouns(stanza: List[Line]) -> set[str]:
 
 	# return lines_with_sentiment
 
-def stanza_sentiment(stanza: Stanza) -> List[dict]:
-	lines = [line.text + (f' ({line.adlib})' if line.adlib else "") for line in stanza if line.text or line.adlib]
+def sentiment_lines(stanza: Stanza) -> List[str]:
+	return [line.text + (f' ({line.adlib})' if line.adlib else "") for line in stanza if line.text or line.adlib]
+
+def split_by_lengths(items: List, lengths: Iterable[int]) -> List[List]:
+	results = []
+	start = 0
+	for length in lengths:
+		results.append(items[start:start + length])
+		start += length
+	return results
+
+def lines_sentiment(stanzas_lines: List[List[str]]) -> List[List[dict]]:
+	lines = list(chain.from_iterable(stanzas_lines))
 	if not lines:
-		return []
-	res = requests.post("http://localhost:8080/", json=lines)
-	res.raise_for_status()
-	return res.json()
+		return [[] for _ in stanzas_lines]
+	return split_by_lengths(services.sentiment(lines), map(len, stanzas_lines))
+
+# Budget for one request to the sentiment server when batching across songs
+SENTIMENT_MAX_LINES = 512
+SENTIMENT_MAX_TOKENS = 8192
+
+def sentiment_batches(
+	songs: Iterable[Tuple[Any, List[List[str]]]],
+	max_lines: int = SENTIMENT_MAX_LINES,
+	max_tokens: int = SENTIMENT_MAX_TOKENS,
+) -> Iterator[List[Tuple[Any, List[List[str]]]]]:
+	"""
+	Group (key, lines per stanza) pairs into batches that fit the budget of
+	one sentiment request. A song over budget on its own is still a batch.
+	"""
+	batch: List[Tuple[Any, List[List[str]]]] = []
+	batch_lines = 0
+	batch_tokens = 0
+
+	for key, stanzas_lines in songs:
+		song_lines = sum(map(len, stanzas_lines))
+		song_tokens = sum(len(line.split()) for stanza_lines in stanzas_lines for line in stanza_lines)
+
+		if batch and (batch_lines + song_lines > max_lines or batch_tokens + song_tokens > max_tokens):
+			yield batch
+			batch, batch_lines, batch_tokens = [], 0, 0
+
+		batch.append((key, stanzas_lines))
+		batch_lines += song_lines
+		batch_tokens += song_tokens
+
+	if batch:
+		yield batch
+
+def batch_lines(batch: List[Tuple[Any, List[List[str]]]]) -> List[str]:
+	return [line for _, stanzas_lines in batch for stanza_lines in stanzas_lines for line in stanza_lines]
+
+def split_batch(batch: List[Tuple[Any, List[List[str]]]], results: List[dict]) -> Iterator[Tuple[Any, List[List[dict]]]]:
+	"""
+	Hand the sentiments of a batch's lines back to its songs.
+	"""
+	start = 0
+	for key, stanzas_lines in batch:
+		song_lines = sum(map(len, stanzas_lines))
+		yield key, split_by_lengths(results[start:start + song_lines], map(len, stanzas_lines))
+		start += song_lines
+
+def corpus_sentiment(
+	songs: Iterable[Tuple[Any, List[List[str]]]],
+	max_lines: int = SENTIMENT_MAX_LINES,
+	max_tokens: int = SENTIMENT_MAX_TOKENS,
+) -> Iterator[Tuple[Any, List[List[dict]]]]:
+	"""
+	Batch the lines of many songs into as few sentiment requests as the
+	budget allows. Takes (key, lines per stanza) pairs and yields
+	(key, sentiment per stanza) pairs in the same order.
+	"""
+	for batch in sentiment_batches(songs, max_lines, max_tokens):
+		lines = batch_lines(batch)
+		yield from split_batch(batch, services.sentiment(lines) if lines else [])
 
 def syllable_is_stressed(syllable: str) -> bool:
 	"""
@@ -149,34 +264,40 @@ def syllable_is_stressed(syllable: str) -> bool:
 	# Does the vowel contain a shortening? (doesn't handled cases where vowel has no modifications)
 	# return 'ˑ' in syllable or '̆' in syllable
 
-def stanza_stress(stanza: List[Line]):
+def line_words(line: Line) -> List[str]:
+	return [token for token, _ in line.tagged if token.isalpha()]
+
+def stress_mask(stresses: Iterable[bool]) -> int:
 	"""
-	TODO: Use the grapheme syllabifiers to accurately show where stress is in each line:
-	- https://www.nltk.org/api/nltk.tokenize.LegalitySyllableTokenizer.html
-	- https://www.nltk.org/api/nltk.tokenize.SyllableTokenizer.html
+	Pack a line's syllable stresses into an int: bit i is set when syllable
+	i is stressed, and a final set bit above the last syllable marks the
+	line's length. aggregates.unpack_stress turns it back into a list.
 	"""
-	phonemized_stanza = (nltk.word_tokenize(phonemizer(line, lang='en_us')) for line in stanza)
-	syllabified_stanza = (
-		(
-			Pronunciation(word).syllables
-			for word
-			in line
-		)
-		for line
-		in phonemized_stanza
-	)
-	stresses = [
-		[
-			[syllable_is_stressed(syllable) for syllable in word]
-			for word
-			in line
-		]
-		for line
-		in syllabified_stanza
+	mask = 0
+	count = 0
+	for stressed in stresses:
+		mask |= stressed << count
+		count += 1
+	return mask | (1 << count)
+
+def stanza_stress(stanza: Stanza, pronunciations: Optional[Dict[str, str]] = None) -> List[int]:
+	"""
+	A stress mask (see stress_mask) for each line of the stanza, read off the
+	stress and length marks of its words' phonemes.
+	"""
+	if any(line.tagged is None for line in stanza):
+		tag_song([stanza])
+	lines_words = [line_words(line) for line in stanza]
+	if pronunciations is None:
+		pronunciations = phonemeize_words(chain.from_iterable(lines_words))
+
+	table = ipa.table()
+	return [
+		stress_mask(chain.from_iterable(table.stress_pattern(pronunciations.get(word, "")) for word in words))
+		for words
+		in lines_words
 	]
 
-	return stresses
-
 def is_vowel(phone: str) -> bool:
 	return phone[0] in ["A", "E", "I", "O", "U"]
 
@@ -184,41 +305,133 @@ def contains_vowels_cmu(rhyme: Tuple[str, ...]) -> bool:
 	return any(is_vowel(phone) for phone in rhyme)
 
 def phonemeize(*args: str):
-	res = requests.post("http://localhost:9090/", json=args)
-	res.raise_for_status()
-	return res.json()
+	return services.phonemize(list(args))
 
-def rhymes(a: str, b: str) -> Optional[Tuple[str, ...]]:
-	# When running this under multiprocessing, it recreates the tree every time. :/
-	# if a in pronunciations_dict and b in pronunciations_dict:
-	# 	rhyme = rhyme_trie.rhymes(a, b)
-	# 	return tuple(rhyme) if rhyme and contains_vowels_cmu(rhyme) else None
-	# else:
-	# Use DeepPhonemeizer
-	first_word, second_word = phonemeize(a, b)
+def local_pronunciations(words: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+	"""
+	Pronunciations of the unique words found in the CMU dictionary or the
+	phoneme cache, and the words that are in neither.
+	"""
+	unique_words = list(dict.fromkeys(words))
+	cmudict = shared_dict()
+	pronunciations = cmudict.get_many(unique_words) if cmudict else {}
+	pronunciations.update(shared_cache().get_many(word for word in unique_words if word not in pronunciations))
+	return pronunciations, [word for word in unique_words if word not in pronunciations]
+
+def remote_pronunciations(words: List[str]) -> Dict[str, str]:
+	return dict(zip(words, phonemeize(*words))) if words else {}
+
+def remember_pronunciations(fetched: Dict[str, str]):
+	# The server persists what it phonemizes; just remember it for this process
+	shared_cache().put_many(fetched, persist=False)
+
+def phonemeize_words(words: Iterable[str]) -> Dict[str, str]:
+	"""
+	Phonemize every unique word. Words in the CMU dictionary resolve locally;
+	the phonemizer server is only asked, in a single request, for words that
+	aren't there or in the phoneme cache.
+	"""
+	pronunciations, missing = local_pronunciations(words)
+	if missing:
+		fetched = remote_pronunciations(missing)
+		remember_pronunciations(fetched)
+		pronunciations.update(fetched)
+
+	return pronunciations
+
+def rhyme_key(phonemes: str) -> Optional[str]:
+	"""
+	The word's ending from its last syllable nucleus on. Two words rhyme
+	exactly when their keys are equal: their shared ending then contains a
+	syllabic segment.
+	"""
+	start = ipa.table().last_syllabic_start(phonemes)
+	return phonemes[start:] if start is not None else None
+
+def common_suffix(first_word: str, second_word: str) -> str:
 	# Reverse words like in rhyming dictionaries to emphazise matches of endings 
-	match = SequenceMatcher(None, first_word[::-1], second_word[::-1]).find_longest_match()
+	size = len(os.path.commonprefix([first_word[::-1], second_word[::-1]]))
+	return first_word[len(first_word) - size:] if size else ""
 
-	# Match exists and ends of words are the same
-	if match.size > 0 and match.a == 0 and match.b == 0:
-		possible_rhyme = "".join(a[:match.size].split()[::-1])
-		if any(phone.match({"syl": 1}) for phone in ft.word_fts(possible_rhyme)):
-			return tuple(possible_rhyme)
-		else:
-			return None
-	else:
-		return None
+def phonemes_rhyme(first_word: str, second_word: str) -> Optional[Tuple[str, ...]]:
+	key = rhyme_key(first_word)
+	if key is not None and key == rhyme_key(second_word):
+		return tuple(common_suffix(first_word, second_word))
+	return None
+
+class RhymeIndex:
+	"""
+	Hashes words by rhyme key so that every group of rhyming words is found
+	in a single pass instead of comparing every pair.
+	"""
+	groups: Dict[str, List[Tuple[Any, str]]]
+
+	def __init__(self, items: Iterable[Tuple[Any, str]] = ()):
+		self.groups = {}
+		for item, phonemes in items:
+			self.add(item, phonemes)
+
+	def add(self, item: Any, phonemes: str):
+		if (key := rhyme_key(phonemes)) is not None:
+			self.groups.setdefault(key, []).append((item, phonemes))
+
+	def rhyming_groups(self) -> Iterator[Tuple[str, List[Tuple[Any, str]]]]:
+		return ((key, group) for key, group in self.groups.items() if len(group) > 1)
+
+def rhymes(a: str, b: str) -> Optional[Tuple[str, ...]]:
+	pronunciations = phonemeize_words([a, b])
+	return phonemes_rhyme(pronunciations[a], pronunciations[b])
+
+def ending_word(line: Line) -> str:
+	if line.tagged is None:
+		tag_song([[line]])
+	return line.tagged[-1][0]
+
+def stanza_ending_words(stanza: Stanza) -> List[Tuple[Line, str]]:
+	return [(line, ending_word(line)) for line in stanza if line.line]
+
+def stanza_rhymes(stanza: Stanza, pronunciations: Optional[Dict[str, str]] = None):
+	"""
+	Find every rhyming pair of line endings in a stanza.
 
-def stanza_rhymes(stanza: List[Line]):
+	`pronunciations` maps ending words to their phonemes; pass one built for
+	the whole song to avoid a phonemizer request per stanza.
+	"""
+	ending_words = stanza_ending_words(stanza)
+	if pronunciations is None:
+		pronunciations = phonemeize_words(word for _, word in ending_words)
 
-	ending_words = ((line, nltk.word_tokenize(line.line)[-1]) for line in stanza if line.line)
+	index = RhymeIndex(((line, word), pronunciations[word]) for line, word in ending_words)
 	rhyming_pairs = [
-		Rhyme(word_a, line_a, word_b, line_b, suffix)
-		for ((line_a, word_a), (line_b, word_b)) in combinations(ending_words, 2)
-		if (suffix := rhymes(word_a, word_b))
+		Rhyme(word_a, line_a, word_b, line_b, tuple(common_suffix(phonemes_a, phonemes_b)), key)
+		for key, group in index.rhyming_groups()
+		for (((line_a, word_a), phonemes_a), ((line_b, word_b), phonemes_b)) in combinations(group, 2)
 	]
 	return rhyming_pairs
 
+def song_rhymes(stanzas: Stanzas, pronunciations: Optional[Dict[str, str]] = None) -> List[List[Rhyme]]:
+	"""
+	Rhymes for every stanza of a song, phonemizing all line endings at once.
+	"""
+	if pronunciations is None:
+		pronunciations = phonemeize_words(
+			word
+			for stanza in stanzas
+			for _, word in stanza_ending_words(stanza)
+		)
+	return [stanza_rhymes(stanza, pronunciations) for stanza in stanzas]
+
+def song_words(stanzas: Iterable[Stanza]) -> Iterator[str]:
+	"""
+	Every word and line ending of a tagged song: the words both the rhyme and
+	the stress analysis need phonemes for.
+	"""
+	stanzas = list(stanzas)
+	return chain(
+		(word for stanza in stanzas for line in stanza for word in line_words(line)),
+		(word for stanza in stanzas for _, word in stanza_ending_words(stanza)),
+	)
+
 def capital_letters():
 	A = ord('A')
 	return (chr(i) for i in range(A, A + 26))
@@ -227,29 +440,27 @@ def replace_at(base: str, replace: str, index: int):
 	return ''.join([base[:index], replace, base[index + 1:]])
 
 def rhyme_structure(rhymes: List[Rhyme], stanza_len: int):
-	rhyme_dict: dict[Tuple[str, ...], Set[str]] = {}
+	"""
+	One letter per group of rhyming lines, in order of each group's first line.
+	"""
+	rhyme_dict: dict[str, Set[int]] = {}
 	for rhyme in rhymes:
-		if rhyme.suffix not in rhyme_dict:
-			rhyme_dict[rhyme.suffix] = set()
-
-		rhyme_dict[rhyme.suffix].update({rhyme.line_a.line_no, rhyme.line_b.line_no})
+		rhyme_dict.setdefault(rhyme.key, set()).update({rhyme.line_a.line_no, rhyme.line_b.line_no})
 	
-	structure_string = "*" * stanza_len
-	for (indexes, letter) in zip(rhyme_dict.values(), capital_letters()):
+	structure = ["*"] * stanza_len
+	for (indexes, letter) in zip(sorted(rhyme_dict.values(), key=min), capital_letters()):
 		for index in indexes:
-			structure_string = replace_at(structure_string, letter, index)
+			structure[index] = letter
 
-	return structure_string
+	return "".join(structure)
 
 def stanza_adlibs(stanza: List[Line]):
 	return [(line_no, adlib) for line_no, adlib in parsed_adlibs if adlib]
 
-def word_frequency(stanza: List[Line]):
-	tokenized_stanza = (nltk.pos_tag(nltk.word_tokenize(line.line)) + (nltk.pos_tag(nltk.word_tokenize(line.adlib)) if line.adlib else []) for line in stanza)
-	
+def word_frequency(tagged_lines: Iterable[TaggedLine]):
 	counter = Counter()
 
-	for line in tokenized_stanza:
+	for line in tagged_lines:
 		words = (
 			lemmatizer.lemmatize(token.lower())
 			for (token, tag)
@@ -267,14 +478,17 @@ def word_frequency(stanza: List[Line]):
 
 def open_spotify_lyrics(path: str) -> Stanzas:
 	with open(path) as f:
-		lines = [
-			{
-				"start_time": timedelta(milliseconds=int(line['startTimeMs'])),
-				"text": line['words']
-			}
-			for line in 
-			json.load(f)['lines']
-		]
+		return spotify_stanzas(json.load(f))
+
+def spotify_stanzas(lyrics: dict) -> Stanzas:
+	lines = [
+		{
+			"start_time": timedelta(milliseconds=int(line['startTimeMs'])),
+			"text": line['words']
+		}
+		for line in 
+		lyrics['lines']
+	]
 
 	return parse_lyrics(lines)
 
@@ -320,57 +534,215 @@ def parse_lyrics(lines: List[SpotifyLine]) -> Stanzas:
 # stanzas = open_spotify_lyrics("lyrics/5lq6hpsabgw22xRYPHVV5c.json")
 
 
-def get(path: Path):
-	stanzas = open_spotify_lyrics(path)
+def stanza_key(stanza: Stanza) -> str:
+	"""
+	Hash of a stanza's text, ignoring differences in whitespace. Every
+	analysis of a stanza only depends on this text and the line numbers.
+	"""
+	return sha1("\n".join(" ".join(line.text.split()) for line in stanza).encode()).hexdigest()
+
+class PreparedSong(NamedTuple):
+	id: str
+	# Key (see stanza_key) of every stanza, in order
+	keys: List[str]
+	# Analysis of every distinct stanza: complete if it was cached, only the
+	# word frequencies so far otherwise
+	results: Dict[str, dict]
+	# Distinct stanzas that weren't cached, tagged
+	fresh: Dict[str, Stanza]
+	pronunciations: Dict[str, str]
+	# Words of the fresh stanzas that need the phonemizer server
+	missing_words: List[str]
+	# Lines of every distinct stanza without a cached sentiment
+	sentiment_lines: Dict[str, List[str]]
+
+def prepare(song_id: str, stanzas: Stanzas) -> PreparedSong:
+	"""
+	Everything about a song that needs neither the phonemizer nor the
+	sentiment server: stanza cache lookups, tagging, word frequencies and
+	local pronunciations. Distinct stanzas are only analysed once, and
+	stanzas already seen anywhere in the corpus come from the stanza cache.
+	"""
+	keys = [stanza_key(stanza) for stanza in stanzas]
+	unique = dict(zip(keys, stanzas))
+
+	results = stanza_cache.shared_cache(ANALYSIS_VERSION).get_many(unique)
+	fresh = {key: stanza for key, stanza in unique.items() if key not in results}
+	pronunciations, missing_words = {}, []
+	if fresh:
+		tag_song(list(fresh.values()))
+		results.update({
+			key: dict(freqs=word_frequency(line.tagged + (line.adlib_tagged or []) for line in stanza))
+			for key, stanza
+			in fresh.items()
+		})
+		pronunciations, missing_words = local_pronunciations(song_words(fresh.values()))
+
+	return PreparedSong(
+		id=song_id,
+		keys=keys,
+		results=results,
+		fresh=fresh,
+		pronunciations=pronunciations,
+		missing_words=missing_words,
+		sentiment_lines={
+			key: sentiment_lines(stanza)
+			for key, stanza
+			in unique.items()
+			if results[key].get('sentiment') is None
+		},
+	)
 
-	base_dir = Path.cwd() / "parsings"
-	song_id = path.stem
-	file = base_dir / f"{song_id}.json.gz"
+def finish(song: PreparedSong, fetched: Dict[str, str], sentiments: Optional[Dict[str, List[dict]]] = None) -> dict:
+	"""
+	Complete a prepared song with the phonemes of its missing words and the
+	sentiments of its stanzas, and assemble its parsing. Stanzas whose
+	sentiment is neither cached nor in `sentiments` get None.
+	"""
+	cache = stanza_cache.shared_cache(ANALYSIS_VERSION)
+	if song.fresh:
+		remember_pronunciations(fetched)
+		pronunciations = {**song.pronunciations, **fetched}
+		stanzas = list(song.fresh.values())
+		for key, stanza, s_rhymes in zip(song.fresh, stanzas, song_rhymes(stanzas, pronunciations)):
+			song.results[key].update(
+				rhymes=[(rhyme.word_a, rhyme.word_b) for rhyme in s_rhymes],
+				rhyme_structure=rhyme_structure(s_rhymes, len(stanza)),
+				stress=stanza_stress(stanza, pronunciations),
+			)
+		cache.put_many({key: song.results[key] for key in song.fresh})
+
+	if sentiments:
+		cache.put_sentiments(sentiments)
+		for key, sentiment in sentiments.items():
+			song.results[key]['sentiment'] = sentiment
+
+	return dict(
+		id=song.id,
+		freqs=[song.results[key]['freqs'] for key in song.keys],
+		rhymes=[song.results[key]['rhymes'] for key in song.keys],
+		rhyme_structure=[song.results[key]['rhyme_structure'] for key in song.keys],
+		sentiment=[song.results[key].get('sentiment') for key in song.keys],
+		stress=[song.results[key]['stress'] for key in song.keys],
+	)
 
-	if file.exists():
-		return
+def analyse(song_id: str, stanzas: Stanzas) -> dict:
+	song = prepare(song_id, stanzas)
+	fetched = remote_pronunciations(song.missing_words)
+	sentiments = None
+	if song.sentiment_lines:
+		sentiments = dict(zip(song.sentiment_lines, lines_sentiment(list(song.sentiment_lines.values()))))
+	return finish(song, fetched, sentiments)
 
-	ss_rhymes = [stanza_rhymes(stanza) for stanza in stanzas]
+def get(path: Path) -> dict:
+	return analyse(path.stem, open_spotify_lyrics(path))
 
-	parsing = dict(
-		id=path.stem,
-		freqs=[word_frequency(stanza) for stanza in stanzas],
-		rhymes=[[(rhyme.word_a, rhyme.word_b) for rhyme in s_rhymes] for s_rhymes in ss_rhymes],
-		rhyme_structure=[rhyme_structure(s_rhymes, len(stanza)) for s_rhymes, stanza in zip(ss_rhymes, stanzas)],
-		sentiment=[stanza_sentiment(stanza) for stanza in stanzas]
-	)
+def get_without_sentiment(path: Path) -> Tuple[dict, List[str], Dict[str, List[str]]]:
+	"""
+	Everything but the sentiments that aren't cached, which the parent
+	process batches across songs. Returns the parsing, the key of each
+	stanza, and the sentiment lines of each distinct stanza still missing
+	one.
+	"""
+	song = prepare(path.stem, open_spotify_lyrics(path))
+	fetched = remote_pronunciations(song.missing_words)
+	return finish(song, fetched), song.keys, song.sentiment_lines
 
-	with gzip.open(file, 'wt', encoding='utf-8') as f:
-		json.dump(parsing, f)
+def song_cost(path: Path) -> int:
+	"""
+	Rough cost of analysing a song: the size of its lyrics file, which grows
+	with its words. Only stats the file, so it costs nothing next to parsing.
+	"""
+	return 1 + path.stat().st_size
 
-def get_word_freq_of_dataset() -> Counter:
-	word_freq = Counter()
+def parse(batch_sentiment: bool = False, incremental: bool = True, dedupe: bool = False, staged: bool = False, **pipeline_options) -> dict:
+	"""
+	Parse every downloaded song into the column store. With `batch_sentiment`,
+	sentiment requests are batched across songs by corpus_sentiment instead of
+	sent once per song.
 
-	with Pool() as p:
-		for index, stanza_freqs in enumerate(p.imap_unordered(
-			get,
-			(Path.cwd() / "lyrics").glob("*.json")
-		)):
-			print(index)
-			for stanza_freq in stanza_freqs:
-				word_freq.update(stanza_freq)
-	
-	return word_freq
+	With `incremental`, only songs that are new, changed since they were
+	parsed, or parsed by an older ANALYSIS_VERSION are dispatched. With
+	`dedupe`, only one song of every cluster of near-duplicates is.
 
-def parse() -> dict:
+	With `staged`, songs go through pipeline.Pipeline (configured by
+	`pipeline_options`), which batches phonemes and sentiments across songs
+	while other songs are being tagged.
+	"""
 	base_dir = Path.cwd() / "parsings"
 	base_dir.mkdir(exist_ok=True)
+	lyrics_dir = Path.cwd() / "lyrics"
 
-	with Pool() as p:
-		for index, _ in enumerate(p.imap_unordered(
-			get,
-			(Path.cwd() / "lyrics").glob("*.json")
-		)):
-			print(index)
+	with Manifest(base_dir / "manifest.jsonl") as manifest, ColumnStore() as store, AggregateStore() as aggregate_store:
+		if incremental:
+			paths = manifest.pending(lyrics_dir, ANALYSIS_VERSION)
+			print(len(paths), "songs to parse")
+		else:
+			paths = list(lyrics_dir.glob("*.json"))
+
+		if dedupe:
+			import dedupe as near_duplicates
+
+			representatives = near_duplicates.find_clusters(lyrics_dir)
+			paths = [path for path in paths if near_duplicates.is_representative(path.stem, representatives)]
+			print(len(paths), "songs to parse after skipping near-duplicates")
+
+		def write(parsing: dict):
+			store.append(parsing)
+			aggregate_store.update(parsing, len(store.ids()) - 1)
+			manifest.record(parsing['id'], lyrics_dir / f"{parsing['id']}.json", ANALYSIS_VERSION)
+
+		costs = [song_cost(path) for path in paths]
+
+		if staged:
+			from pipeline import Pipeline
+
+			# Longest songs first, so none of them is left running on its own at the end
+			paths = [path for _, path in sorted(zip(costs, paths), key=lambda item: item[0], reverse=True)]
+			Pipeline(write, **pipeline_options).run(paths)
+			print("Done!")
+			return
+
+		chunks = list(scheduling.chunks(paths, costs))
+		utilization = scheduling.Utilization()
+		with Pool(initializer=lemmas.save_on_exit) as p:
+			def parsed(function) -> Iterator:
+				for results, busy in p.imap_unordered(partial(scheduling.run_chunk, function, label=attrgetter('stem')), chunks):
+					utilization.add(busy)
+					yield from results
+
+			if batch_sentiment:
+				cache = stanza_cache.shared_cache(ANALYSIS_VERSION)
+				songs = (
+					((parsing, keys, missing), list(missing.values()))
+					for parsing, keys, missing
+					in parsed(get_without_sentiment)
+				)
+				for index, ((parsing, keys, missing), sentiments) in enumerate(corpus_sentiment(songs)):
+					fetched = dict(zip(missing, sentiments))
+					cache.put_sentiments(fetched)
+					parsing['sentiment'] = [
+						fetched[key] if sentiment is None else sentiment
+						for key, sentiment
+						in zip(keys, parsing['sentiment'])
+					]
+					write(parsing)
+					print(index)
+			else:
+				for index, parsing in enumerate(parsed(get)):
+					write(parsing)
+					print(index)
+
+			# Let workers exit cleanly so they save their lemma caches
+			p.close()
+			p.join()
+
+		utilization.report(f"Parsed {len(paths)} songs")
 
 	print("Done!")
 
-parse()
+if __name__ == '__main__':
+	parse()
 
 # for index, stanza in enumerate(stanzas, 1):
 # 	print("Stanza", index)
@@ -0,0 +1,78 @@
+"""
+A persistent word -> IPA store shared by the phonemizer server and the
+parse_lyrics workers (see sqlite_cache.py), so common words never reach the
+neural model twice.
+
+Warm the cache with the vocabulary of every downloaded song:
+	python phoneme_cache.py warm
+"""
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+from sqlite_cache import SQLiteCache
+from utils import chunked, per_process
+
+DEFAULT_PATH = Path.cwd() / "phonemes.sqlite"
+
+class PhonemeCache(SQLiteCache[str, str]):
+	schema = "CREATE TABLE IF NOT EXISTS phonemes (word TEXT PRIMARY KEY, ipa TEXT NOT NULL)"
+	insert = "INSERT OR REPLACE INTO phonemes (word, ipa) VALUES (?, ?)"
+
+	def __init__(self, path: Path = DEFAULT_PATH, maxsize: Optional[int] = 100_000):
+		super().__init__(path, maxsize)
+
+	def select(self, words: List[str]) -> Iterable[Tuple[str, str]]:
+		return self.connection.execute(
+			f"SELECT word, ipa FROM phonemes WHERE word IN ({', '.join('?' * len(words))})",
+			words,
+		).fetchall()
+
+	def get(self, word: str) -> Optional[str]:
+		return self.get_many([word]).get(word)
+
+	def __len__(self) -> int:
+		with self.lock:
+			return self.connection.execute("SELECT COUNT(*) FROM phonemes").fetchone()[0]
+
+@per_process
+def shared_cache() -> PhonemeCache:
+	"""
+	The cache for the current process.
+	"""
+	return PhonemeCache()
+
+def corpus_vocabulary(lyrics_dir: Path) -> Iterable[str]:
+	import json
+	import nltk
+
+	for path in lyrics_dir.glob("*.json"):
+		with open(path) as f:
+			lines = json.load(f)['lines']
+		for line in lines:
+			yield from nltk.word_tokenize(line['words'])
+
+def warm(lyrics_dir: Path = Path.cwd() / "lyrics", batch_size: int = 1000):
+	"""
+	Phonemize every word of the corpus that isn't cached yet. The server
+	stores its results in the cache, so we only need to ask it.
+	"""
+	import services
+
+	cache = shared_cache()
+	vocabulary = list(dict.fromkeys(corpus_vocabulary(lyrics_dir)))
+	cached = cache.get_many(vocabulary)
+	missing = [word for word in vocabulary if word not in cached]
+	print(len(vocabulary), "words,", len(missing), "not cached")
+
+	for index, batch in enumerate(chunked(missing, batch_size)):
+		cache.put_many(dict(zip(batch, services.phonemize(batch))), persist=False)
+		print(min((index + 1) * batch_size, len(missing)), "/", len(missing))
+
+	print("Done!")
+
+if __name__ == '__main__':
+	import sys
+
+	if sys.argv[1:] == ["warm"]:
+		warm()
+	else:
+		print(len(shared_cache()), "cached pronunciations")
@@ -1,12 +1,164 @@
+"""
+Phonemizer service for parse_lyrics.
+
+	python phonemeizer_server.py --workers 4
+
+serves with waitress, which keeps connections alive and queues requests
+across a pool of threads. `--workers` model threads pull from a bounded
+queue of pending texts; requests that would overflow it get a 503 so parse
+workers back off instead of piling up. `--dev` uses Flask's own server.
+"""
+from collections import Counter, deque
+from concurrent.futures import Future
 from flask import Flask, request, jsonify
 from dp.phonemizer import Phonemizer
-from functools import cache
+from os import environ, cpu_count
+from phoneme_cache import PhonemeCache
+from queue import Queue, Empty, Full
+from statistics import quantiles
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+from typing import Deque, Dict, List, Optional, Tuple
+
+CHECKPOINT = environ.get("PHONEMIZER_CHECKPOINT", 'en_us_cmudict_ipa_forward.pt')
+# Texts handed to the model per forward pass
+BATCH_SIZE = int(environ.get("PHONEMIZER_BATCH_SIZE", 64))
+# How long to wait for other requests to join a batch
+BATCH_WINDOW = float(environ.get("PHONEMIZER_BATCH_WINDOW_MS", 10)) / 1000
+# Requests waiting for a model worker before we start refusing them
+MAX_QUEUE = int(environ.get("PHONEMIZER_MAX_QUEUE", 256))
+
+phoneme_cache = PhonemeCache()
+
+def load_phonemizer() -> Phonemizer:
+	return Phonemizer.from_checkpoint(CHECKPOINT)
+
+class Metrics:
+	def __init__(self, window: int = 1000):
+		self.lock = Lock()
+		self.requests = 0
+		self.rejected = 0
+		self.texts = 0
+		self.cache_hits = 0
+		self.batch_sizes: Counter[int] = Counter()
+		self.latencies: Deque[float] = deque(maxlen=window)
+
+	def record_request(self, texts: int, cache_hits: int, latency: float):
+		with self.lock:
+			self.requests += 1
+			self.texts += texts
+			self.cache_hits += cache_hits
+			self.latencies.append(latency)
+
+	def record_rejection(self):
+		with self.lock:
+			self.rejected += 1
+
+	def record_batch(self, size: int):
+		with self.lock:
+			self.batch_sizes[size] += 1
+
+	def snapshot(self) -> dict:
+		with self.lock:
+			latencies = list(self.latencies)
+			batches = self.batch_sizes.total()
+			batch_texts = sum(size * count for size, count in self.batch_sizes.items())
+			percentiles = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+
+			return dict(
+				requests=self.requests,
+				rejected=self.rejected,
+				texts=self.texts,
+				cache_hits=self.cache_hits,
+				batches=batches,
+				mean_batch_size=batch_texts / batches if batches else 0,
+				batch_sizes=dict(sorted(self.batch_sizes.items())),
+				latency_ms={
+					f"p{p}": round(percentiles[p - 1] * 1000, 2) if percentiles else None
+					for p in (50, 90, 99)
+				},
+			)
+
+metrics = Metrics()
+
+class MicroBatcher:
+	"""
+	Collects texts from concurrent requests for up to `window` seconds and
+	phonemizes all of them in one call to the model. Each phonemizer passed
+	in gets its own worker thread; pass the same one several times to share
+	a checkpoint.
+	"""
+	def __init__(self, phonemizers: List[Phonemizer], batch_size: int = BATCH_SIZE, window: float = BATCH_WINDOW, max_queue: int = MAX_QUEUE):
+		self.batch_size = batch_size
+		self.window = window
+		self.queue: Queue[Tuple[List[str], Future]] = Queue(max_queue)
+		self.workers = [Thread(target=self.run, args=(phonemizer,), daemon=True) for phonemizer in phonemizers]
+		for worker in self.workers:
+			worker.start()
+
+	def submit(self, texts: List[str]) -> Future:
+		"""
+		Raises queue.Full when the model workers are too far behind.
+		"""
+		future = Future()
+		self.queue.put_nowait((texts, future))
+		return future
+
+	def collect(self) -> List[Tuple[List[str], Future]]:
+		pending = [self.queue.get()]
+		size = len(pending[0][0])
+		deadline = monotonic() + self.window
+
+		while size < self.batch_size and (timeout := deadline - monotonic()) > 0:
+			try:
+				pending.append(self.queue.get(timeout=timeout))
+			except Empty:
+				break
+			size += len(pending[-1][0])
 
-phonemizer = Phonemizer.from_checkpoint('en_us_cmudict_ipa_forward.pt')
+		return pending
+
+	def run(self, phonemizer: Phonemizer):
+		while True:
+			pending = self.collect()
+			texts = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+			metrics.record_batch(len(texts))
+
+			try:
+				ipas = phonemizer(texts, lang="en_us", batch_size=self.batch_size)
+			except Exception as e:
+				for _, future in pending:
+					future.set_exception(e)
+				continue
+
+			results = dict(zip(texts, ipas))
+			phoneme_cache.put_many(results)
+			for _, future in pending:
+				future.set_result(results)
+
+	def alive(self) -> int:
+		return sum(worker.is_alive() for worker in self.workers)
+
+batcher: Optional[MicroBatcher] = None
+
+def phonemize_many(texts: List[str]) -> List[str]:
+	"""
+	Phonemize texts, answering duplicates and cached texts without the model.
+	"""
+	start = perf_counter()
+	unique_texts = list(dict.fromkeys(texts))
+	results: Dict[str, str] = phoneme_cache.get_many(unique_texts)
+	cache_hits = len(results)
+
+	missing = [text for text in unique_texts if text not in results]
+	if missing:
+		results.update(batcher.submit(missing).result())
+
+	metrics.record_request(len(texts), cache_hits, perf_counter() - start)
+	return [results[text] for text in texts]
 
-@cache
 def phonemize(text: str) -> str:
-	return phonemizer(text, lang="en_us")
+	return phonemize_many([text])[0]
 
 app = Flask(__name__)
 
@@ -17,6 +169,58 @@ def index_get():
 @app.post("/")
 def index_post():
 	texts = request.json
-	return jsonify([phonemize(text) for text in texts])
+	try:
+		return jsonify(phonemize_many(texts))
+	except Full:
+		metrics.record_rejection()
+		return jsonify(error="Phonemizer queue is full"), 503, {"Retry-After": "1"}
+
+@app.get("/health")
+def health():
+	alive = batcher.alive() if batcher else 0
+	return jsonify(status="ok" if alive else "down", workers=alive), 200 if alive else 503
+
+@app.get("/metrics")
+def metrics_get():
+	return jsonify(
+		queue_depth=batcher.queue.qsize() if batcher else 0,
+		queue_capacity=batcher.queue.maxsize if batcher else 0,
+		workers=batcher.alive() if batcher else 0,
+		**metrics.snapshot(),
+	)
+
+def serve(host: str = '0.0.0.0', port: int = 9090, workers: int = 1, shared_model: bool = False, threads: Optional[int] = None, max_queue: int = MAX_QUEUE, dev: bool = False):
+	global batcher
+
+	import torch
+	# Split the cores between the model workers instead of having each grab all of them
+	torch.set_num_threads(max(1, (cpu_count() or 1) // workers))
+
+	if shared_model:
+		phonemizers = [load_phonemizer()] * workers
+	else:
+		phonemizers = [load_phonemizer() for _ in range(workers)]
+	batcher = MicroBatcher(phonemizers, max_queue=max_queue)
+
+	if dev:
+		app.run(host, port, threaded=True)
+	else:
+		from waitress import serve as waitress_serve
+		# Enough threads for every parse worker to have a request in flight
+		threads = threads or max(8, cpu_count() or 1)
+		waitress_serve(app, host=host, port=port, threads=threads, connection_limit=threads * 4, backlog=max_queue)
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+
+	parser = ArgumentParser(description="Serve the DeepPhonemizer model over HTTP.")
+	parser.add_argument("--host", default='0.0.0.0')
+	parser.add_argument("--port", type=int, default=9090)
+	parser.add_argument("--workers", type=int, default=1, help="model worker threads")
+	parser.add_argument("--shared-model", action="store_true", help="load one checkpoint for all workers")
+	parser.add_argument("--threads", type=int, help="HTTP threads (default: max(8, cores))")
+	parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="pending requests before answering 503")
+	parser.add_argument("--dev", action="store_true", help="use Flask's development server")
+	args = parser.parse_args()
 
-app.run('0.0.0.0', 9090)
+	serve(args.host, args.port, args.workers, args.shared_model, args.threads, args.max_queue, args.dev)
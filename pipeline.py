@@ -0,0 +1,222 @@
+"""
+A staged parse that overlaps local CPU work with the requests to the model
+servers. Songs stream through five stages connected by bounded queues:
+
+	load ─> prepare (process pool) ─> fetch (async batches) ─> finish (process pool) ─> write
+
+- load reads the lyrics files;
+- prepare tags and counts words (parse_lyrics.prepare) in CPU_WORKERS processes;
+- fetch batches the missing phonemes and sentiments of BATCH_SONGS songs into
+  requests, with IO_CONCURRENCY batches in flight;
+- finish works out each song's rhymes and stress (parse_lyrics.finish) in the
+  same processes;
+- write hands the parsings to the caller, which stores them, so the main
+  process does nothing but write.
+
+Every stage blocks once QUEUE_SIZE songs are waiting for the next one, so a
+slow stage holds back the ones before it instead of piling songs up in memory.
+"""
+from itertools import chain
+from multiprocessing import Pool
+from os import cpu_count, environ
+from pathlib import Path
+from threading import BoundedSemaphore, Thread
+from typing import Callable, Dict, Iterable, List, Tuple
+import asyncio
+import json
+import queue
+import lemmas
+import services
+from scheduling import Utilization, timed
+from parse_lyrics import PreparedSong, batch_lines, finish, prepare, sentiment_batches, split_batch, spotify_stanzas
+
+CPU_WORKERS = int(environ.get("PIPELINE_CPU_WORKERS", cpu_count() or 1))
+IO_CONCURRENCY = int(environ.get("PIPELINE_IO_CONCURRENCY", 4))
+BATCH_SONGS = int(environ.get("PIPELINE_BATCH_SONGS", 16))
+QUEUE_SIZE = int(environ.get("PIPELINE_QUEUE_SIZE", 64))
+
+# Marks the end of a queue
+_done = object()
+
+def _prepare(item: Tuple[str, bytes]) -> Tuple[PreparedSong, float]:
+	song_id, raw = item
+	return timed(prepare, song_id, spotify_stanzas(json.loads(raw)))
+
+def _finish(item: Tuple[PreparedSong, Dict[str, str], Dict[str, List[dict]]]) -> Tuple[dict, float]:
+	return timed(finish, *item)
+
+class Pipeline:
+	def __init__(
+		self,
+		write: Callable[[dict], None],
+		cpu_workers: int = CPU_WORKERS,
+		io_concurrency: int = IO_CONCURRENCY,
+		batch_songs: int = BATCH_SONGS,
+		queue_size: int = QUEUE_SIZE,
+	):
+		self.write = write
+		self.cpu_workers = cpu_workers
+		self.io_concurrency = io_concurrency
+		self.batch_songs = batch_songs
+		self.queue_size = queue_size
+		# Songs loaded but not yet prepared
+		self.preparing = BoundedSemaphore(queue_size)
+		self.prepared: "queue.Queue" = queue.Queue(queue_size)
+		# Songs fetched but not yet written. The semaphore bounds the queue,
+		# so the pool's callbacks never block on it
+		self.finishing = BoundedSemaphore(queue_size)
+		self.finished: "queue.Queue" = queue.Queue()
+
+	def run(self, paths: Iterable[Path]) -> int:
+		"""
+		Parse every song in `paths`. Returns the number of songs written;
+		the first error in any stage is raised here.
+		"""
+		self.utilization = Utilization(self.cpu_workers)
+		with Pool(self.cpu_workers, initializer=lemmas.save_on_exit) as pool:
+			Thread(target=self.load, args=(pool, paths), daemon=True).start()
+			Thread(target=self.fetch_all, args=(pool,), daemon=True).start()
+			written = self.write_all()
+
+			# Let workers exit cleanly so they save their lemma caches
+			pool.close()
+			pool.join()
+
+		self.utilization.report(f"Prepared and finished {written} songs")
+		return written
+
+	def load(self, pool, paths: Iterable[Path]):
+		try:
+			for path in paths:
+				self.preparing.acquire()
+				pool.apply_async(
+					_prepare,
+					((path.stem, path.read_bytes()),),
+					callback=self._prepared,
+					error_callback=self._failed,
+				)
+		except Exception as e:
+			self.prepared.put(e)
+
+		# Wait for the songs still being prepared
+		for _ in range(self.queue_size):
+			self.preparing.acquire()
+		self.prepared.put(_done)
+
+	def _prepared(self, result: Tuple[PreparedSong, float]):
+		song, busy = result
+		self.utilization.add(busy)
+		self.prepared.put(song)
+		self.preparing.release()
+
+	def _failed(self, error: BaseException):
+		# Errors are passed down the stages to be raised by write_all
+		self.prepared.put(error)
+		self.preparing.release()
+
+	def next_batch(self) -> Tuple[list, bool]:
+		"""
+		Wait for a prepared song, then take whatever else is ready up to
+		BATCH_SONGS. Also returns whether the queue has ended.
+		"""
+		batch = []
+		item = self.prepared.get()
+		while item is not _done:
+			batch.append(item)
+			if len(batch) == self.batch_songs:
+				break
+			try:
+				item = self.prepared.get_nowait()
+			except queue.Empty:
+				break
+		return batch, item is _done
+
+	def _finished(self, result: Tuple[dict, float]):
+		parsing, busy = result
+		self.utilization.add(busy)
+		self.finished.put(parsing)
+
+	def fetch_all(self, pool):
+		try:
+			asyncio.run(self.fetch(pool))
+		except Exception as e:
+			# fetch never got to end the queue, so write_all would wait forever
+			self.finished.put(e)
+			self.finished.put(_done)
+
+	async def fetch(self, pool):
+		slots = asyncio.Semaphore(self.io_concurrency)
+		tasks = set()
+
+		async def fetch_batch(client: services.AsyncClient, songs: List[PreparedSong]):
+			try:
+				results = await self.fetch_batch(client, songs)
+			except Exception as e:
+				self.finished.put(e)
+				return
+			finally:
+				slots.release()
+			for result in results:
+				await asyncio.to_thread(self.finishing.acquire)
+				pool.apply_async(_finish, (result,), callback=self._finished, error_callback=self.finished.put)
+
+		async with services.AsyncClient(self.io_concurrency * 2) as client:
+			done = False
+			while not done:
+				batch, done = await asyncio.to_thread(self.next_batch)
+				errors = [item for item in batch if isinstance(item, BaseException)]
+				songs = [item for item in batch if not isinstance(item, BaseException)]
+				for error in errors:
+					self.finished.put(error)
+				if songs:
+					await slots.acquire()
+					task = asyncio.create_task(fetch_batch(client, songs))
+					tasks.add(task)
+					task.add_done_callback(tasks.discard)
+
+			await asyncio.gather(*tasks)
+
+		# Wait for the songs still being finished or written
+		for _ in range(self.queue_size):
+			await asyncio.to_thread(self.finishing.acquire)
+		self.finished.put(_done)
+
+	async def fetch_batch(self, client: services.AsyncClient, songs: List[PreparedSong]) -> List[Tuple[PreparedSong, Dict[str, str], Dict[str, List[dict]]]]:
+		"""
+		One phonemizer request for the missing words of every song in the
+		batch, and as few sentiment requests as their lines need, all sent
+		at once.
+		"""
+		words = list(dict.fromkeys(chain.from_iterable(song.missing_words for song in songs)))
+		sentiment_songs = [(index, list(song.sentiment_lines.values())) for index, song in enumerate(songs) if song.sentiment_lines]
+		batches = [batch for batch in sentiment_batches(sentiment_songs) if batch_lines(batch)]
+
+		phonemes, *sentiments = await asyncio.gather(
+			client.phonemize(words) if words else asyncio.sleep(0, []),
+			*(client.sentiment(batch_lines(batch)) for batch in batches),
+		)
+		pronunciations = dict(zip(words, phonemes))
+
+		stanzas_sentiments = {}
+		for batch, results in zip(batches, sentiments):
+			stanzas_sentiments.update(split_batch(batch, results))
+
+		return [
+			(
+				song,
+				{word: pronunciations[word] for word in song.missing_words},
+				dict(zip(song.sentiment_lines, stanzas_sentiments.get(index, [[] for _ in song.sentiment_lines]))),
+			)
+			for index, song
+			in enumerate(songs)
+		]
+
+	def write_all(self) -> int:
+		written = 0
+		while (item := self.finished.get()) is not _done:
+			if isinstance(item, BaseException):
+				raise item
+			self.write(item)
+			self.finishing.release()
+			written += 1
+		return written
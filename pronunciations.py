@@ -0,0 +1,130 @@
+"""
+The CMU pronunciation dictionary, converted to IPA and packed into one
+read-only file (cmudict.idx) that every process memory-maps. Pool workers
+share the same pages through the OS page cache, so nothing is rebuilt or
+copied per worker, and only words missing from the dictionary need the
+phonemizer service.
+
+	python pronunciations.py build
+
+File layout (little-endian):
+	magic b"CMUIPA01", count: u32, padding: u32
+	word offsets: u32[count + 1], IPA offsets: u32[count + 1]
+	words (sorted UTF-8, lowercase), IPA (UTF-8)
+"""
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+import mmap
+import struct
+import sys
+from utils import per_process
+
+DEFAULT_PATH = Path.cwd() / "cmudict.idx"
+MAGIC = b"CMUIPA01"
+HEADER = struct.Struct("<8sII")
+
+# ARPAbet to IPA in the style of the en_us_cmudict_ipa phonemizer checkpoint.
+# Stress marks go right before the stressed vowel.
+VOWELS = {
+	'AA': 'ɑ', 'AE': 'æ', 'AH': 'ʌ', 'AO': 'ɔ', 'AW': 'aʊ', 'AY': 'aɪ',
+	'EH': 'ɛ', 'ER': 'ɝ', 'EY': 'eɪ', 'IH': 'ɪ', 'IY': 'i', 'OW': 'oʊ',
+	'OY': 'ɔɪ', 'UH': 'ʊ', 'UW': 'u',
+}
+UNSTRESSED_VOWELS = {'AH': 'ə', 'ER': 'ɚ'}
+CONSONANTS = {
+	'B': 'b', 'CH': 'tʃ', 'D': 'd', 'DH': 'ð', 'F': 'f', 'G': 'g', 'HH': 'h',
+	'JH': 'dʒ', 'K': 'k', 'L': 'l', 'M': 'm', 'N': 'n', 'NG': 'ŋ', 'P': 'p',
+	'R': 'ɹ', 'S': 's', 'SH': 'ʃ', 'T': 't', 'TH': 'θ', 'V': 'v', 'W': 'w',
+	'Y': 'j', 'Z': 'z', 'ZH': 'ʒ',
+}
+STRESS_MARKS = {'0': '', '1': 'ˈ', '2': 'ˌ'}
+
+def arpabet_to_ipa(phones: Iterable[str]) -> str:
+	ipa = []
+	for phone in phones:
+		base, stress = phone.rstrip('012'), phone[len(phone.rstrip('012')):]
+		if base in VOWELS:
+			vowel = UNSTRESSED_VOWELS.get(base, VOWELS[base]) if stress == '0' else VOWELS[base]
+			ipa.append(STRESS_MARKS.get(stress, '') + vowel)
+		else:
+			ipa.append(CONSONANTS[base])
+	return "".join(ipa)
+
+def build(path: Path = DEFAULT_PATH):
+	from nltk.corpus import cmudict
+
+	entries: Dict[bytes, bytes] = {}
+	for word, phones in cmudict.entries():
+		# Keep the first (most common) pronunciation
+		entries.setdefault(word.lower().encode(), arpabet_to_ipa(phones).encode())
+
+	words = sorted(entries)
+	word_offsets = [0]
+	ipa_offsets = [0]
+	for word in words:
+		word_offsets.append(word_offsets[-1] + len(word))
+		ipa_offsets.append(ipa_offsets[-1] + len(entries[word]))
+
+	temporary = path.with_name(path.name + ".tmp")
+	with open(temporary, "wb") as f:
+		f.write(HEADER.pack(MAGIC, len(words), 0))
+		f.write(struct.pack(f"<{len(words) + 1}I", *word_offsets))
+		f.write(struct.pack(f"<{len(words) + 1}I", *ipa_offsets))
+		f.write(b"".join(words))
+		f.write(b"".join(entries[word] for word in words))
+	temporary.replace(path)
+	print(len(words), "pronunciations written to", path)
+
+class PronunciationDict:
+	def __init__(self, path: Path = DEFAULT_PATH):
+		with open(path, "rb") as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, self.count, _ = HEADER.unpack_from(self.map, 0)
+		if magic != MAGIC:
+			raise ValueError(f"{path} is not a pronunciation index")
+
+		view = memoryview(self.map)
+		offsets_size = (self.count + 1) * 4
+		start = HEADER.size
+		self.word_offsets = view[start:start + offsets_size].cast('I')
+		self.ipa_offsets = view[start + offsets_size:start + 2 * offsets_size].cast('I')
+		self.words_start = start + 2 * offsets_size
+		self.ipa_start = self.words_start + self.word_offsets[self.count]
+
+	def _word(self, index: int) -> bytes:
+		return self.map[self.words_start + self.word_offsets[index]:self.words_start + self.word_offsets[index + 1]]
+
+	def get(self, word: str) -> Optional[str]:
+		key = word.lower().encode()
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			if self._word(middle) < key:
+				low = middle + 1
+			else:
+				high = middle
+		if low < self.count and self._word(low) == key:
+			return self.map[self.ipa_start + self.ipa_offsets[low]:self.ipa_start + self.ipa_offsets[low + 1]].decode()
+		return None
+
+	def get_many(self, words: Iterable[str]) -> Dict[str, str]:
+		return {word: ipa for word in dict.fromkeys(words) if (ipa := self.get(word)) is not None}
+
+	def __len__(self) -> int:
+		return self.count
+
+@per_process
+def shared_dict() -> Optional[PronunciationDict]:
+	"""
+	The memory-mapped dictionary for this process, or None if it hasn't been
+	built.
+	"""
+	return PronunciationDict() if DEFAULT_PATH.exists() else None
+
+if __name__ == '__main__':
+	if sys.argv[1:] == ["build"]:
+		build()
+	else:
+		pronunciations = shared_dict()
+		print(f"{len(pronunciations)} pronunciations" if pronunciations else "Not built yet; run `python pronunciations.py build`")
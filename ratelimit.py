@@ -0,0 +1,37 @@
+from threading import Lock
+from time import monotonic, sleep
+import asyncio
+
+class TokenBucket:
+	"""
+	Allows `rate` acquisitions per second on average, with bursts of up to
+	`capacity`. Usable from threads (acquire) and from asyncio (acquire_async).
+	"""
+	def __init__(self, rate: float, capacity: float = 1):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = monotonic()
+		self.lock = Lock()
+
+	def _take(self) -> float:
+		"""
+		Take a token if one is available; otherwise return how long to wait.
+		"""
+		with self.lock:
+			now = monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return 0
+			return (1 - self.tokens) / self.rate
+
+	def acquire(self):
+		while (wait := self._take()) > 0:
+			sleep(wait)
+
+	async def acquire_async(self):
+		while (wait := self._take()) > 0:
+			await asyncio.sleep(wait)
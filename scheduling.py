@@ -0,0 +1,122 @@
+"""
+Size-aware scheduling for Pool work. Songs differ in length by orders of
+magnitude, so handing them to a Pool one at a time in glob order means a lot
+of IPC for tiny songs and a long tail when a huge one comes last. Instead:
+
+- chunks() dispatches the costliest items first and packs every chunk up to
+  a cost target that shrinks with the work that is left (guided
+  self-scheduling), so every worker finishes at about the same time;
+- run_chunk() processes a whole chunk per task, skipping items that fail,
+  and times it;
+- Utilization reports how busy the workers were kept.
+"""
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple, TypeVar
+import os
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Chunks per worker for the work that is left; more means a shorter tail and more IPC
+CHUNKS_PER_WORKER = 4
+# No chunk aims lower than this share of a worker's total work, so the cheap
+# songs at the end aren't sent one at a time
+MIN_CHUNK_SHARE = 1 / 32
+# Nor does any chunk hold more items than this, so results (and the progress
+# they report) come back steadily, and a crash loses at most a chunk per worker
+MAX_CHUNK_ITEMS = 64
+
+def workers() -> int:
+	# What Pool() uses by default
+	return os.cpu_count() or 1
+
+def chunks(items: Sequence[T], costs: Sequence[float], processes: int = 0, max_items: int = MAX_CHUNK_ITEMS) -> Iterator[List[T]]:
+	"""
+	Split `items` into chunks, costliest first. Each chunk aims for the
+	remaining cost divided by CHUNKS_PER_WORKER chunks per worker, and holds
+	at most `max_items`.
+	"""
+	processes = processes or workers()
+	order = sorted(range(len(items)), key=lambda index: costs[index], reverse=True)
+	remaining = sum(costs)
+	minimum = remaining / processes * MIN_CHUNK_SHARE
+
+	chunk: List[T] = []
+	chunk_cost = 0.0
+	for index in order:
+		chunk.append(items[index])
+		chunk_cost += costs[index]
+		if chunk_cost >= max(remaining / (processes * CHUNKS_PER_WORKER), minimum) or len(chunk) == max_items:
+			yield chunk
+			remaining -= chunk_cost
+			chunk, chunk_cost = [], 0.0
+
+	if chunk:
+		yield chunk
+
+def sized_batches(items: Iterable[T], size: Callable[[T], int], budget: int) -> Iterator[List[T]]:
+	"""
+	Batch a stream of items that can't be sorted up front, closing a batch
+	once its size reaches `budget`.
+	"""
+	batch: List[T] = []
+	batch_size = 0
+	for item in items:
+		batch.append(item)
+		batch_size += size(item)
+		if batch_size >= budget:
+			yield batch
+			batch, batch_size = [], 0
+
+	if batch:
+		yield batch
+
+def batch_budget(total_size: int, processes: int = 0, minimum: int = 1 << 16, maximum: int = 1 << 24) -> int:
+	"""
+	Size budget for sized_batches that gives every worker about
+	CHUNKS_PER_WORKER batches of a stream of `total_size`.
+	"""
+	return max(minimum, min(maximum, total_size // ((processes or workers()) * CHUNKS_PER_WORKER)))
+
+def run_chunk(function: Callable[[T], R], chunk: List[T], label: Callable[[T], str] = str) -> Tuple[List[R], float]:
+	"""
+	Apply `function` to every item of a chunk in a worker, returning the
+	results and the seconds it took. Use with functools.partial.
+
+	An item that fails is reported by its `label` and left out of the
+	results, so it doesn't take the rest of the chunk down with it.
+	"""
+	start = perf_counter()
+	results = []
+	for item in chunk:
+		try:
+			results.append(function(item))
+		except Exception as e:
+			print(f"Skipping {label(item)}: {e!r}")
+	return results, perf_counter() - start
+
+def timed(function: Callable[..., R], *args) -> Tuple[R, float]:
+	start = perf_counter()
+	result = function(*args)
+	return result, perf_counter() - start
+
+class Utilization:
+	"""
+	Share of the workers' wall-clock time spent on tasks, from the busy time
+	every task reports.
+	"""
+	def __init__(self, processes: int = 0):
+		self.processes = processes or workers()
+		self.start = perf_counter()
+		self.busy = 0.0
+		self.tasks = 0
+
+	def add(self, busy: float):
+		self.busy += busy
+		self.tasks += 1
+
+	def report(self, label: str) -> float:
+		elapsed = perf_counter() - self.start
+		utilization = self.busy / (elapsed * self.processes) if elapsed else 0.0
+		print(f"{label}: {self.tasks} tasks in {elapsed:.1f}s on {self.processes} workers, {utilization:.0%} utilization")
+		return utilization
@@ -1,39 +1,197 @@
-from csv import DictReader
+"""
+Downloads Spotify lyrics for the songs in *.csv into lyrics/<track id>.json.
+
+Requests run concurrently under a token-bucket rate limit and back off on
+429 and 5xx responses. Tracks without lyrics are remembered in
+lyrics/.missing so later runs don't ask again, and every outcome is appended
+to lyrics/.journal. Point --base-url at a local server to test against a
+stand-in for the lyrics API.
+
+Requests go through httpx if it is installed, and otherwise through a
+blocking requests session in threads.
+"""
 from pathlib import Path
+from random import random
+from time import time
+from typing import Iterable, Optional, Set
+import asyncio
+import json
+import os
 import requests
-from time import sleep
-from pathlib import Path
+from requests.adapters import HTTPAdapter
+from ratelimit import TokenBucket
+from songs import SongIndex
 
-for path in Path.cwd().glob("*.csv"):
-	with open(path) as f:
-		songs = {song['spotify'].split("/")[-1] for song in list(DictReader(f))[:5000]}
+try:
+	import httpx
+except ImportError:
+	httpx = None
 
-	songs_len = len(songs)
+BASE_URL = os.environ.get("LYRICS_API_URL", "https://spotify-lyric-api.herokuapp.com/")
+# Songs taken from the top of each CSV
+SONGS_PER_CSV = 5000
+CONCURRENCY = 4
+# Requests per second
+RATE = 2.0
+MAX_ATTEMPTS = 6
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
-	base = Path.cwd() / "lyrics"
-	base.mkdir(exist_ok=True)
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout) + ((httpx.TransportError,) if httpx else ())
+STATUS_ERRORS = (requests.HTTPError,) + ((httpx.HTTPStatusError,) if httpx else ())
+
+class ScrapeState:
+	"""
+	What previous runs already know: downloaded files, tracks without lyrics,
+	and a journal of every outcome.
+	"""
+	def __init__(self, base: Path):
+		self.base = base
+		self.missing_path = base / ".missing"
+		self.journal_path = base / ".journal"
+
+		self.downloaded = {entry.name.removesuffix(".json") for entry in os.scandir(base) if entry.name.endswith(".json")}
+		self.missing = set(self.missing_path.read_text().split()) if self.missing_path.exists() else set()
+
+		self._missing_file = open(self.missing_path, "a")
+		self._journal = open(self.journal_path, "a")
+
+	def pending(self, track_ids: Iterable[str]) -> list:
+		return [track_id for track_id in dict.fromkeys(track_ids) if track_id not in self.downloaded and track_id not in self.missing]
+
+	def log(self, track_id: str, status: str, **extra):
+		self._journal.write(json.dumps(dict(id=track_id, status=status, time=time(), **extra)) + "\n")
+		self._journal.flush()
+
+	def save(self, track_id: str, text: str):
+		file = self.base / f"{track_id}.json"
+		temporary = file.with_name(f".{file.name}.tmp")
+		temporary.write_text(text)
+		temporary.replace(file)
+		self.downloaded.add(track_id)
+		self.log(track_id, "downloaded")
+
+	def mark_missing(self, track_id: str):
+		self.missing.add(track_id)
+		self._missing_file.write(track_id + "\n")
+		self._missing_file.flush()
+		self.log(track_id, "missing")
+
+	def close(self):
+		self._missing_file.close()
+		self._journal.close()
 
-	for index, track_id in enumerate(songs, 1):
-		file = base / f"{track_id}.json"
-		
-		if file.exists():
-			print(track_id, "already downloaded -- skipping")
-			continue
+class Client:
+	"""
+	GET requests from inside the event loop, over at most `concurrency`
+	pooled connections. Responses of either library have the same
+	status_code, headers, text and raise_for_status().
+	"""
+	def __init__(self, concurrency: int, timeout: float = 30):
+		self.concurrency = concurrency
+		self.timeout = timeout
+		self.client = None
+		self.session = None
 
-		print(index, "/", songs_len, "songs:", track_id)
-		res = requests.get("https://spotify-lyric-api.herokuapp.com/", params=dict(trackid=track_id))
+	async def __aenter__(self):
+		if httpx is not None:
+			limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+			self.client = await httpx.AsyncClient(timeout=self.timeout, limits=limits).__aenter__()
+		else:
+			self.session = requests.Session()
+			adapter = HTTPAdapter(pool_maxsize=self.concurrency)
+			self.session.mount("http://", adapter)
+			self.session.mount("https://", adapter)
+		return self
 
+	async def __aexit__(self, *args):
+		if self.client is not None:
+			await self.client.__aexit__(*args)
+		if self.session is not None:
+			self.session.close()
+
+	async def get(self, url: str, params: dict):
+		if self.client is not None:
+			return await self.client.get(url, params=params)
+		return await asyncio.to_thread(self.session.get, url, params=params, timeout=self.timeout)
+
+def retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+	if retry_after and retry_after.isdigit():
+		return float(retry_after)
+	# Exponential backoff with jitter
+	return min(60, 2 ** attempt) * (0.5 + random())
+
+async def fetch(client: Client, bucket: TokenBucket, state: ScrapeState, track_id: str, base_url: str):
+	for attempt in range(MAX_ATTEMPTS):
+		await bucket.acquire_async()
 		try:
-			res.raise_for_status()
-		except requests.exceptions.HTTPError as e:
+			res = await client.get(base_url, dict(trackid=track_id))
+		except TRANSPORT_ERRORS as e:
+			retry_after = None
+			error = repr(e)
+		else:
 			if res.status_code == 404:
 				print(track_id, "doesn't have lyrics on Spotify -- skipping")
-				continue
-			else:
-				raise e
-		
-		file.touch(exist_ok=True)
-		file.write_text(res.text)
+				state.mark_missing(track_id)
+				return
+			if res.status_code not in RETRY_STATUSES:
+				res.raise_for_status()
+				state.save(track_id, res.text)
+				return
+			retry_after = res.headers.get("Retry-After")
+			error = f"HTTP {res.status_code}"
+
+		delay = retry_delay(attempt, retry_after)
+		print(track_id, error, "-- retrying in", round(delay, 1), "seconds")
+		await asyncio.sleep(delay)
+
+	state.log(track_id, "failed", error=error)
+	print(track_id, "failed after", MAX_ATTEMPTS, "attempts")
+
+async def scrape_async(track_ids: list, state: ScrapeState, concurrency: int, rate: float, base_url: str):
+	bucket = TokenBucket(rate, capacity=concurrency)
+	queue: asyncio.Queue = asyncio.Queue()
+	for track_id in track_ids:
+		queue.put_nowait(track_id)
+	done = 0
+
+	async def worker(client):
+		nonlocal done
+		while True:
+			try:
+				track_id = queue.get_nowait()
+			except asyncio.QueueEmpty:
+				return
+			try:
+				await fetch(client, bucket, state, track_id, base_url)
+			except STATUS_ERRORS as e:
+				state.log(track_id, "error", error=f"HTTP {e.response.status_code}")
+				print(track_id, e)
+			done += 1
+			print(done, "/", len(track_ids), "songs:", track_id)
+
+	async with Client(concurrency) as client:
+		await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+def csv_track_ids(songs_per_csv: int = SONGS_PER_CSV) -> Set[str]:
+	track_ids = set()
+	for path in Path.cwd().glob("*.csv"):
+		song_index = SongIndex.load(path)
+		track_ids.update(song_index.track_ids(range(min(songs_per_csv, len(song_index)))))
+	return track_ids
+
+def scrape(concurrency: int = CONCURRENCY, rate: float = RATE, base_url: str = BASE_URL, songs_per_csv: int = SONGS_PER_CSV):
+	base = Path.cwd() / "lyrics"
+	base.mkdir(exist_ok=True)
+
+	state = ScrapeState(base)
+	try:
+		track_ids = state.pending(csv_track_ids(songs_per_csv))
+		print(len(track_ids), "songs to download;", len(state.downloaded), "downloaded and", len(state.missing), "without lyrics already")
+		asyncio.run(scrape_async(track_ids, state, concurrency, rate, base_url))
+	finally:
+		state.close()
 
-		sleep(0.5)
+	print("Done!")
 
+if __name__ == '__main__':
+	scrape()
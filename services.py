@@ -0,0 +1,112 @@
+"""
+Clients for the phonemizer (phonemeizer_server.py) and sentiment
+(deepmoji-server) services. Every process keeps one pooled keep-alive
+session, and every call has a timeout and retries on 429/5xx so one slow
+request doesn't stall a parse worker.
+
+If httpx is installed, AsyncClient sends requests concurrently over one
+connection pool; otherwise it runs them on the session in threads.
+"""
+from os import environ
+from typing import Any, List
+import asyncio
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils import per_process
+
+try:
+	import httpx
+except ImportError:
+	httpx = None
+
+PHONEMIZER_URL = environ.get("PHONEMIZER_URL", "http://localhost:9090/")
+SENTIMENT_URL = environ.get("SENTIMENT_URL", "http://localhost:8080/")
+TIMEOUT = float(environ.get("SERVICE_TIMEOUT", 60))
+RETRIES = int(environ.get("SERVICE_RETRIES", 3))
+BACKOFF = float(environ.get("SERVICE_BACKOFF", 0.5))
+# Requests in flight at once per process when using httpx
+CONCURRENCY = int(environ.get("SERVICE_CONCURRENCY", 8))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+@per_process
+def session() -> requests.Session:
+	"""
+	The keep-alive session of the current process.
+	"""
+	retry = Retry(
+		total=RETRIES,
+		backoff_factor=BACKOFF,
+		status_forcelist=RETRY_STATUSES,
+		# Both services are pure functions of their input, so POSTs are safe to repeat
+		allowed_methods=None,
+		respect_retry_after_header=True,
+		raise_on_status=False,
+	)
+	adapter = HTTPAdapter(pool_connections=2, pool_maxsize=CONCURRENCY, max_retries=retry)
+	session = requests.Session()
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+def post_json(url: str, payload: Any) -> Any:
+	res = session().post(url, json=payload, timeout=TIMEOUT)
+	res.raise_for_status()
+	return res.json()
+
+async def _post_json_async(client: "httpx.AsyncClient", semaphore: asyncio.Semaphore, url: str, payload: Any) -> Any:
+	for attempt in range(RETRIES + 1):
+		async with semaphore:
+			try:
+				res = await client.post(url, json=payload)
+			except httpx.TransportError:
+				if attempt == RETRIES:
+					raise
+				res = None
+
+		if res is not None and (res.status_code not in RETRY_STATUSES or attempt == RETRIES):
+			res.raise_for_status()
+			return res.json()
+
+		retry_after = res.headers.get("Retry-After") if res is not None else None
+		delay = float(retry_after) if retry_after and retry_after.isdigit() else BACKOFF * 2 ** attempt
+		await asyncio.sleep(delay)
+
+class AsyncClient:
+	"""
+	The services from inside a running event loop, with at most
+	`concurrency` requests in flight. Without httpx, requests run on the
+	blocking session in threads.
+	"""
+	def __init__(self, concurrency: int = CONCURRENCY):
+		self.concurrency = concurrency
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.client = None
+
+	async def __aenter__(self):
+		if httpx is not None:
+			limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+			self.client = await httpx.AsyncClient(timeout=TIMEOUT, limits=limits).__aenter__()
+		return self
+
+	async def __aexit__(self, *args):
+		if self.client is not None:
+			await self.client.__aexit__(*args)
+
+	async def post_json(self, url: str, payload: Any) -> Any:
+		if self.client is not None:
+			return await _post_json_async(self.client, self.semaphore, url, payload)
+		async with self.semaphore:
+			return await asyncio.to_thread(post_json, url, payload)
+
+	async def phonemize(self, texts: List[str]) -> List[str]:
+		return await self.post_json(PHONEMIZER_URL, texts)
+
+	async def sentiment(self, lines: List[str]) -> List[dict]:
+		return await self.post_json(SENTIMENT_URL, lines)
+
+def phonemize(texts: List[str]) -> List[str]:
+	return post_json(PHONEMIZER_URL, texts)
+
+def sentiment(lines: List[str]) -> List[dict]:
+	return post_json(SENTIMENT_URL, lines)
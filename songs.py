@@ -0,0 +1,124 @@
+"""
+Song metadata from the SPARQL CSV exports (see spotify.sparql) as a compact
+typed index: track ids in one fixed-width bytes blob and years, genres and
+artists as integer arrays, with genres and artists interned. The index is
+built by streaming the CSV once and cached in a binary sidecar next to it
+(`top_songs.csv` -> `top_songs.csv.idx`), which is rebuilt whenever the CSV
+changes.
+"""
+from array import array
+from csv import DictReader
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+import pickle
+
+# Bump whenever the layout of the sidecar changes
+INDEX_VERSION = 1
+
+def extract_id(url: str):
+	return url.split("/")[-1]
+
+def decade(year: int) -> str:
+	# 1995 -> "90s", 2005 -> "00s"
+	return f"{str(year)[2]}0s" if year else ''
+
+class SongIndex:
+	track_id_width: int
+	track_id_blob: bytes
+	# 0 when the release year is unknown
+	years: array
+	genre_codes: array
+	genres: List[str]
+	artist_codes: array
+	artists: List[str]
+
+	def __init__(self, track_ids: List[str], years: array, genre_codes: array, genres: List[str], artist_codes: array, artists: List[str]):
+		self.track_id_width = max(map(len, track_ids), default=0)
+		self.track_id_blob = b"".join(track_id.encode().ljust(self.track_id_width) for track_id in track_ids)
+		self.years = years
+		self.genre_codes = genre_codes
+		self.genres = genres
+		self.artist_codes = artist_codes
+		self.artists = artists
+
+	@classmethod
+	def from_csv(cls, path: Path) -> "SongIndex":
+		track_ids = []
+		years = array('H')
+		genre_codes = array('I')
+		artist_codes = array('I')
+		genres: Dict[str, int] = {}
+		artists: Dict[str, int] = {}
+
+		with open(path, newline='') as f:
+			for song in DictReader(f):
+				track_ids.append(extract_id(song['spotify']))
+				years.append(int(song['release_year']) if song['release_year'] else 0)
+				genre_codes.append(genres.setdefault(song['genre'], len(genres)))
+				artist_codes.append(artists.setdefault(song['artist_name'], len(artists)))
+
+		return cls(track_ids, years, genre_codes, list(genres), artist_codes, list(artists))
+
+	@classmethod
+	def load(cls, path: Path) -> "SongIndex":
+		sidecar = path.with_name(path.name + ".idx")
+		stat = path.stat()
+		stamp = (INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+
+		if sidecar.exists():
+			with open(sidecar, "rb") as f:
+				cached_stamp, index = pickle.load(f)
+			if cached_stamp == stamp:
+				return index
+
+		index = cls.from_csv(path)
+		with open(sidecar, "wb") as f:
+			pickle.dump((stamp, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+		return index
+
+	def __len__(self) -> int:
+		return len(self.years)
+
+	def track_id(self, row: int) -> str:
+		start = row * self.track_id_width
+		return self.track_id_blob[start:start + self.track_id_width].decode().rstrip()
+
+	def track_ids(self, rows: Optional[Iterable[int]] = None) -> Iterator[str]:
+		return (self.track_id(row) for row in (rows if rows is not None else range(len(self))))
+
+	def key(self, name: str) -> Callable[[int], Hashable]:
+		keys = {
+			'year': lambda row: str(self.years[row]) if self.years[row] else '',
+			'decade': lambda row: decade(self.years[row]),
+			'genre': lambda row: self.genres[self.genre_codes[row]],
+			'artist': lambda row: self.artists[self.artist_codes[row]],
+		}
+		return keys[name]
+
+	def group_rows(self, key: Union[str, Callable[[int], Hashable]], rows: Optional[Iterable[int]] = None) -> Dict[Hashable, array]:
+		"""
+		Row numbers of every group. Year and decade groups are ordered
+		chronologically (unknown first), any other key alphabetically.
+		"""
+		key_of = self.key(key) if isinstance(key, str) else key
+		groups: Dict[Hashable, array] = {}
+		first_year: Dict[Hashable, int] = {}
+
+		for row in (rows if rows is not None else range(len(self))):
+			group = key_of(row)
+			if group not in groups:
+				groups[group] = array('I')
+				first_year[group] = self.years[row]
+			groups[group].append(row)
+			first_year[group] = min(first_year[group], self.years[row])
+
+		order = (lambda group: first_year[group]) if key in ('year', 'decade') else (lambda group: str(group))
+		return {group: groups[group] for group in sorted(groups, key=order)}
+
+	def groups(self, key: Union[str, Callable[[int], Hashable]], rows: Optional[Iterable[int]] = None) -> Iterator[Tuple[Hashable, Iterator[str]]]:
+		"""
+		Yield (group, track ids) pairs; track ids are only decoded as they
+		are consumed.
+		"""
+		for group, group_rows in self.group_rows(key, rows).items():
+			yield group, self.track_ids(group_rows)
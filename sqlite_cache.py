@@ -0,0 +1,76 @@
+"""
+Base for the caches that parse workers and the phonemizer server share
+through a SQLite file: lookups go through an in-memory LRU first, and only
+the keys it misses are queried, a chunk of keys per statement.
+"""
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Generic, Hashable, Iterable, List, Optional, Tuple, TypeVar
+import sqlite3
+from lru import LRUCache
+from utils import QUERY_CHUNK_SIZE, chunked
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class SQLiteCache(Generic[K, V]):
+	# CREATE TABLE statement for the cache's table
+	schema: str
+	# Statement that stores one of the rows to_rows() yields
+	insert: str
+	memory: LRUCache[K, V]
+
+	def __init__(self, path: Path, maxsize: Optional[int]):
+		self.path = path
+		self.memory = LRUCache(maxsize)
+		self.lock = Lock()
+		path.parent.mkdir(parents=True, exist_ok=True)
+		# WAL lets any number of processes read while one of them writes
+		self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute(self.schema)
+		self.connection.commit()
+
+	def select(self, keys: List[K]) -> Iterable[Tuple[K, V]]:
+		"""
+		The stored (key, value) pairs of a chunk of keys.
+		"""
+		raise NotImplementedError
+
+	def to_rows(self, values: Dict[K, V]) -> Iterable[tuple]:
+		return values.items()
+
+	def get_many(self, keys: Iterable[K]) -> Dict[K, V]:
+		"""
+		Return the value of every cached key; missing keys are left out.
+		"""
+		found = {}
+		missing = []
+		with self.lock:
+			for key in dict.fromkeys(keys):
+				if (value := self.memory.get(key)) is not None:
+					found[key] = value
+				else:
+					missing.append(key)
+
+			for chunk in chunked(missing, QUERY_CHUNK_SIZE):
+				rows = list(self.select(chunk))
+				self.memory.update(rows)
+				found.update(rows)
+
+		return found
+
+	def put_many(self, values: Dict[K, V], persist: bool = True):
+		if not values:
+			return
+		with self.lock:
+			self.memory.update(values.items())
+			if persist:
+				self.connection.executemany(self.insert, self.to_rows(values))
+				self.connection.commit()
+
+	def info(self) -> dict:
+		return self.memory.info()
+
+	def close(self):
+		self.connection.close()
@@ -0,0 +1,76 @@
+"""
+Analyses of single stanzas, keyed by a hash of their text. Choruses repeat
+within a song and whole stanzas repeat across remasters, live versions and
+features, so parse workers look stanzas up here before analysing them. The
+cache is shared through parsings/stanzas.sqlite (see sqlite_cache.py).
+
+Entries are only valid for the ANALYSIS_VERSION that produced them. An
+analysis has a 'sentiment' only once one has been stored.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+from sqlite_cache import SQLiteCache
+from utils import per_process
+
+DEFAULT_PATH = Path.cwd() / "parsings" / "stanzas.sqlite"
+
+class StanzaCache(SQLiteCache[str, dict]):
+	schema = """
+		CREATE TABLE IF NOT EXISTS stanzas (
+			key TEXT PRIMARY KEY,
+			version INTEGER NOT NULL,
+			analysis TEXT NOT NULL,
+			sentiment TEXT
+		)
+	"""
+	insert = "INSERT OR REPLACE INTO stanzas (key, version, analysis, sentiment) VALUES (?, ?, ?, ?)"
+
+	def __init__(self, version: int, path: Path = DEFAULT_PATH, maxsize: Optional[int] = 10_000):
+		self.version = version
+		super().__init__(path, maxsize)
+
+	def select(self, keys: List[str]) -> Iterable[Tuple[str, dict]]:
+		rows = self.connection.execute(
+			f"SELECT key, analysis, sentiment FROM stanzas WHERE version = ? AND key IN ({', '.join('?' * len(keys))})",
+			[self.version, *keys],
+		)
+		for key, analysis, sentiment in rows:
+			analysis = json.loads(analysis)
+			if sentiment is not None:
+				analysis['sentiment'] = json.loads(sentiment)
+			yield key, analysis
+
+	def to_rows(self, analyses: Dict[str, dict]) -> Iterable[tuple]:
+		return (
+			(
+				key,
+				self.version,
+				json.dumps({name: value for name, value in analysis.items() if name != 'sentiment'}, separators=(",", ":")),
+				json.dumps(analysis['sentiment']) if analysis.get('sentiment') is not None else None,
+			)
+			for key, analysis in analyses.items()
+		)
+
+	def put_sentiments(self, sentiments: Dict[str, List[Any]]):
+		"""
+		Add sentiments to stanzas that are already cached.
+		"""
+		if not sentiments:
+			return
+		with self.lock:
+			for key, sentiment in sentiments.items():
+				if (analysis := self.memory.get(key)) is not None:
+					analysis['sentiment'] = sentiment
+			self.connection.executemany(
+				"UPDATE stanzas SET sentiment = ? WHERE key = ? AND version = ?",
+				((json.dumps(sentiment), key, self.version) for key, sentiment in sentiments.items()),
+			)
+			self.connection.commit()
+
+@per_process
+def shared_cache(version: int) -> StanzaCache:
+	"""
+	The cache of `version` for the current process.
+	"""
+	return StanzaCache(version)
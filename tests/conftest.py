@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+@pytest.fixture(scope="session")
+def segment_table(tmp_path_factory):
+	"""
+	ipa.table() without writing ipa_features.npz to the working directory.
+	"""
+	import ipa
+
+	table = ipa.SegmentTable.load(tmp_path_factory.mktemp("ipa") / "ipa_features.npz")
+	patch = pytest.MonkeyPatch()
+	patch.setattr(ipa, "table", lambda: table)
+	yield table
+	patch.undo()
@@ -0,0 +1,50 @@
+from collections import Counter
+from aggregates import CORPUS, AggregateStore, RhymeSchemes
+from columns import ColumnStore
+
+class SchemeLengths(RhymeSchemes):
+	# Same aggregator with a changed add()
+	version = 2
+
+	def add(self, acc: Counter, rhyme_structure):
+		acc.update(len(rhyme_scheme) for rhyme_scheme in rhyme_structure)
+
+def parsing(song_id: str, rhyme_structure: list) -> dict:
+	return dict(id=song_id, rhyme_structure=rhyme_structure)
+
+def test_stale_after_reparse_and_version_change(tmp_path):
+	path = tmp_path / "aggregates.sqlite"
+	with ColumnStore(tmp_path / "columns") as store:
+		store.append(parsing("a", ["AAAA", "ABAB"]))
+		store.append(parsing("b", ["ABBA"]))
+
+		with AggregateStore(path, [RhymeSchemes()]) as aggregates:
+			assert aggregates.stale(store) == {"a": 0, "b": 1}
+			aggregates.refresh(store)
+			assert aggregates.stale(store) == {}
+			assert aggregates.group_totals({"all": ["a", "b"]}) == {
+				"all": {"rhyme_schemes": Counter(monorhyme=1, alternating=1, enclosed=1)},
+				CORPUS: {},
+			}
+
+			# A re-parsed song is stale until it has been aggregated again
+			store.append(parsing("a", ["AABB"]))
+			assert aggregates.stale(store) == {"a": 2}
+			aggregates.update(parsing("a", ["AABB"]), 2)
+			assert aggregates.stale(store) == {}
+
+		with AggregateStore(path, [SchemeLengths()]) as aggregates:
+			assert aggregates.stale(store) == {"a": 2, "b": 1}
+			aggregates.refresh(store)
+			assert aggregates.stale(store) == {}
+			assert aggregates.group_totals({"all": ["a", "b"]})["all"] == {"rhyme_schemes": Counter({4: 2})}
+
+def test_group_totals_memoized_until_a_song_changes(tmp_path):
+	with AggregateStore(tmp_path / "aggregates.sqlite", [RhymeSchemes()]) as aggregates:
+		aggregates.update(parsing("a", ["AAAA"]), 0)
+		groups = {"70s": ["a"], "80s": ["b"]}
+		assert aggregates.group_totals(groups)["70s"]["rhyme_schemes"] == Counter(monorhyme=1)
+		assert aggregates.group_totals(groups)["80s"]["rhyme_schemes"] == Counter()
+
+		aggregates.update(parsing("b", ["ABAB"]), 1)
+		assert aggregates.group_totals(groups)["80s"]["rhyme_schemes"] == Counter(alternating=1)
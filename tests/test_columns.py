@@ -0,0 +1,41 @@
+from columns import COLUMNS, ColumnStore
+
+def parsing(song_id: str, freqs: dict) -> dict:
+	return dict(id=song_id, freqs=[freqs], rhymes=[[]], rhyme_structure=["AA"], sentiment=[None], stress=[[5]])
+
+def test_recover_truncated_tail(tmp_path):
+	path = tmp_path / "columns"
+	with ColumnStore(path) as store:
+		store.append(parsing("a", {"one": 1}))
+		store.append(parsing("b", {"two": 2}))
+
+	# A crash while appending "c": some columns got a full row, one got
+	# half of it, and ids.txt nothing
+	with open(path / "freqs.jsonl", "ab") as f:
+		f.write(b'[{"three":3}]\n')
+	with open(path / "rhymes.jsonl", "ab") as f:
+		f.write(b'[[')
+
+	with ColumnStore(path) as store:
+		assert store.ids() == ["a", "b"]
+		store.append(parsing("c", {"four": 4}))
+
+	store = ColumnStore(path)
+	assert list(store.scan("freqs", "rhymes")) == [
+		("a", [{"one": 1}], [[]]),
+		("b", [{"two": 2}], [[]]),
+		("c", [{"four": 4}], [[]]),
+	]
+	for column in COLUMNS:
+		assert len((path / f"{column}.jsonl").read_bytes().splitlines()) == 3
+
+def test_latest_row_wins(tmp_path):
+	with ColumnStore(tmp_path) as store:
+		store.append(parsing("a", {"old": 1}))
+		store.append(parsing("b", {"other": 1}))
+		store.append(parsing("a", {"new": 1}))
+
+	store = ColumnStore(tmp_path)
+	assert store.latest_rows() == {"a": 2, "b": 1}
+	assert list(store.scan("freqs", ids=["a"])) == [("a", [{"new": 1}])]
+	assert [row for row, *_ in store.scan_rows("freqs", start=1)] == [1, 2]
@@ -0,0 +1,77 @@
+import json
+import numpy as np
+import pytest
+from dedupe import EMPTY, NUM_PERM, ROWS, THRESHOLD, Signatures, collapse, is_representative, signature
+
+def test_collapse_counts_each_cluster_once():
+	groups = {'70s': {'x', 'y'}, '90s': {'a', 'z'}, '00s': {'b'}}
+	representatives = {'a': 'a', 'b': 'a', 'x': 'x', 'y': 'x'}
+	assert collapse(groups, representatives) == {'70s': {'x'}, '90s': {'a', 'z'}, '00s': set()}
+
+def test_collapse_prefers_dated_groups():
+	# Undated songs are grouped first, but must not take clusters away from the decades
+	groups = {'': {'b', 'c'}, '70s': {'x'}, '90s': {'a'}}
+	representatives = {'a': 'a', 'b': 'a'}
+	collapsed = collapse(groups, representatives)
+	assert collapsed == {'': {'c'}, '70s': {'x'}, '90s': {'a'}}
+	assert list(collapsed) == list(groups)
+
+def test_is_representative():
+	representatives = {'a': 'a', 'b': 'a'}
+	assert is_representative('a', representatives)
+	assert not is_representative('b', representatives)
+	assert is_representative('c', representatives)
+
+def write_lyrics(path, text):
+	path.write_text(json.dumps({'lines': [{'words': line} for line in text.split("\n")]}))
+	return path
+
+VERSE = "\n".join(
+	f"line {index} of the song goes round and round with word{index}"
+	for index in range(12)
+)
+
+@pytest.fixture
+def lyrics_dir(tmp_path):
+	write_lyrics(tmp_path / "original.json", VERSE)
+	# A radio edit: the same lyrics with one word changed
+	write_lyrics(tmp_path / "radio_edit.json", VERSE.replace("word11", "edit"))
+	write_lyrics(tmp_path / "other.json", "\n".join(f"something else entirely number {index}" for index in range(12)))
+	write_lyrics(tmp_path / "instrumental.json", "")
+	return tmp_path
+
+def agreement(first, second) -> float:
+	return float(np.mean(first == second))
+
+def test_signature_estimates_similarity(lyrics_dir):
+	original = signature(lyrics_dir / "original.json")
+	assert original.shape == (NUM_PERM,)
+	assert (signature(lyrics_dir / "original.json") == original).all()
+	assert agreement(original, signature(lyrics_dir / "radio_edit.json")) >= THRESHOLD
+	assert agreement(original, signature(lyrics_dir / "other.json")) < 0.2
+	assert (signature(lyrics_dir / "instrumental.json") == EMPTY).all()
+
+def test_candidates_share_a_band():
+	signatures = np.arange(5 * NUM_PERM, dtype=np.uint32).reshape(5, NUM_PERM)
+	# Row 1 shares only the last band with row 0
+	signatures[1, -ROWS:] = signatures[0, -ROWS:]
+	# Row 2 agrees with row 0 on most hashes, but never on a whole band
+	signatures[2] = signatures[0]
+	signatures[2, ::ROWS] += 1
+	# Songs without words never match each other
+	signatures[3:] = EMPTY
+
+	index = Signatures([str(row) for row in range(5)], np.zeros((5, 2), dtype=np.int64), signatures)
+	assert {tuple(sorted(pair)) for pair in index.candidates()} == {(0, 1)}
+
+def test_clusters_group_near_duplicates(lyrics_dir):
+	signatures = Signatures.load(lyrics_dir / "minhash.npz")
+	assert signatures.update(lyrics_dir) == 4
+	assert signatures.clusters() == [["original", "radio_edit"]]
+	# Sharing a band isn't enough below the threshold
+	assert signatures.clusters(threshold=1.0) == []
+
+	signatures.save(lyrics_dir / "minhash.npz")
+	reloaded = Signatures.load(lyrics_dir / "minhash.npz")
+	assert reloaded.update(lyrics_dir) == 0
+	assert reloaded.clusters() == [["original", "radio_edit"]]
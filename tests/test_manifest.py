@@ -0,0 +1,39 @@
+from manifest import Entry, Manifest
+
+def test_reload_non_empty_manifest(tmp_path):
+	lyrics = tmp_path / "song.json"
+	lyrics.write_text('{"lines": []}')
+	path = tmp_path / "manifest.jsonl"
+
+	with Manifest(path) as manifest:
+		manifest.record("song", lyrics, 1)
+		manifest.record("other", lyrics, 1)
+		manifest.record("song", lyrics, 2)
+	# A crash can leave a truncated last line behind
+	with open(path, "a") as f:
+		f.write('{"id": "trunc')
+
+	reloaded = Manifest(path)
+	assert set(reloaded.entries) == {"song", "other"}
+	assert reloaded.entries["song"] == manifest.entries["song"]
+	assert isinstance(reloaded.entries["song"], Entry)
+	assert reloaded.entries["song"].version == 2
+	assert reloaded.is_current("song", lyrics, lyrics.stat(), 2)
+	assert not reloaded.is_current("other", lyrics, lyrics.stat(), 2)
+
+def test_pending_does_not_adopt_unknown_parsings(tmp_path):
+	lyrics_dir = tmp_path / "lyrics"
+	lyrics_dir.mkdir()
+	for song_id in ("known", "unknown"):
+		(lyrics_dir / f"{song_id}.json").write_text('{"lines": []}')
+	(lyrics_dir / "notes.txt").write_text("")
+	path = tmp_path / "manifest.jsonl"
+
+	with Manifest(path) as manifest:
+		manifest.record("known", lyrics_dir / "known.json", 2)
+		assert manifest.pending(lyrics_dir, 2) == [lyrics_dir / "unknown.json"]
+		assert "unknown" not in manifest.entries
+		# A parsing by an older version is stale, not current
+		assert sorted(manifest.pending(lyrics_dir, 3)) == [lyrics_dir / "known.json", lyrics_dir / "unknown.json"]
+
+	assert set(Manifest(path).entries) == {"known"}
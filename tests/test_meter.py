@@ -0,0 +1,32 @@
+from aggregates import METER_MIN_SYLLABLES, detect_meter, unpack_stress
+from parse_lyrics import Line, stanza_stress, stress_mask
+
+def mask(pattern: str) -> int:
+	# "x" for a stressed syllable, "." for an unstressed one
+	return stress_mask(syllable == "x" for syllable in pattern)
+
+def test_stress_mask_round_trip():
+	assert stress_mask([True, False, True]) == 0b1101
+	assert stress_mask([]) == 1
+	for stresses in ([False] * 5, [True, False, False, True], [True] * 9):
+		assert unpack_stress(stress_mask(stresses)) == stresses
+
+def test_detect_meter():
+	assert detect_meter(mask(".x.x.x.x")) == 'iambic'
+	assert detect_meter(mask("x.x.x.x.")) == 'trochaic'
+	assert detect_meter(mask("..x..x..x")) == 'anapestic'
+	assert detect_meter(mask("x..x..x..")) == 'dactylic'
+	# One syllable in ten off still counts
+	assert detect_meter(mask(".x.x.xxx.x")) == 'iambic'
+	assert detect_meter(mask("xx..xx..")) == 'irregular'
+	assert detect_meter(mask("x" * (METER_MIN_SYLLABLES - 1))) is None
+	assert detect_meter(stress_mask([])) is None
+
+def test_stanza_stress(segment_table):
+	line = Line(0, "Money, honey (yeah)")
+	line.tagged = [("Money", "NN"), (",", ","), ("honey", "NN")]
+	unknown = Line(1, "Zzyzx")
+	unknown.tagged = [("Zzyzx", "NNP")]
+	pronunciations = {"Money": "ˈmʌni", "honey": "ˈhʌni"}
+
+	assert stanza_stress([line, unknown], pronunciations) == [mask("x.x."), mask("")]
@@ -0,0 +1,29 @@
+from parse_lyrics import RhymeIndex, phonemes_rhyme, rhyme_key
+
+def test_rhyme_key_starts_at_last_nucleus(segment_table):
+	assert rhyme_key("kæt") == "æt"
+	assert rhyme_key("ɪnˈtɛnd") == rhyme_key("ˈɛnd") == "ɛnd"
+	# No syllable nucleus, so nothing to rhyme on
+	assert rhyme_key("ʃ") is None
+
+def test_rhyme_index_groups_by_nucleus(segment_table):
+	index = RhymeIndex([
+		("cat", "kæt"),
+		("dog", "dɔɡ"),
+		("hat", "hæt"),
+		("shh", "ʃ"),
+		("log", "lɔɡ"),
+		("bed", "bɛd"),
+		("mat", "mæt"),
+	])
+	assert dict(index.rhyming_groups()) == {
+		"æt": [("cat", "kæt"), ("hat", "hæt"), ("mat", "mæt")],
+		"ɔɡ": [("dog", "dɔɡ"), ("log", "lɔɡ")],
+	}
+	assert index.groups["ɛd"] == [("bed", "bɛd")]
+	assert all(item != "shh" for group in index.groups.values() for item, _ in group)
+
+def test_phonemes_rhyme(segment_table):
+	assert phonemes_rhyme("kæt", "hæt") == ("æ", "t")
+	assert phonemes_rhyme("ɪnˈtɛnd", "ˈɛnd") == ("ɛ", "n", "d")
+	assert phonemes_rhyme("kæt", "bɛd") is None
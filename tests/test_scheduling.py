@@ -0,0 +1,28 @@
+from scheduling import chunks, run_chunk
+
+def test_chunks_costliest_first_and_balanced():
+	costs = [50.0, 1.0, 40.0] + [1.0] * 59 + [30.0]
+	items = list(range(len(costs)))
+	result = list(chunks(items, costs, processes=2))
+
+	assert sorted(item for chunk in result for item in chunk) == items
+	# The big songs go out first, one per chunk
+	assert result[:3] == [[0], [2], [62]]
+	# Then the cheap ones, in chunks that shrink with the work left but
+	# never below MIN_CHUNK_SHARE of a worker's work (180 / 2 / 32)
+	chunk_costs = [sum(costs[item] for item in chunk) for chunk in result[3:]]
+	assert chunk_costs == sorted(chunk_costs, reverse=True)
+	assert chunk_costs[0] > chunk_costs[-1] == 3
+
+def test_chunks_item_cap():
+	items = list(range(200))
+	result = list(chunks(items, [1.0] * 200, processes=1, max_items=16))
+
+	assert sorted(item for chunk in result for item in chunk) == items
+	assert max(len(chunk) for chunk in result) == 16
+
+def test_run_chunk_skips_failing_items():
+	results, seconds = run_chunk(lambda item: 10 // item, [5, 0, 2])
+
+	assert results == [2, 5]
+	assert seconds >= 0
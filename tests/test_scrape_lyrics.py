@@ -0,0 +1,109 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import monotonic
+from urllib.parse import parse_qs, urlparse
+import asyncio
+import json
+import pytest
+import scrape_lyrics
+from ratelimit import TokenBucket
+from scrape_lyrics import ScrapeState, scrape_async
+
+class LyricsAPI(BaseHTTPRequestHandler):
+	"""
+	Stand-in for the lyrics API: 'missing' has no lyrics, 'busy' is rate
+	limited twice and 'flaky' fails once before they succeed.
+	"""
+	failures = {'busy': [429, 429], 'flaky': [503]}
+
+	def do_GET(self):
+		track_id = parse_qs(urlparse(self.path).query)['trackid'][0]
+		self.server.requests.append((track_id, monotonic()))
+		failures = self.server.failures.setdefault(track_id, list(self.failures.get(track_id, [])))
+
+		if track_id == 'missing':
+			self.reply(404, b'{"error": true}')
+		elif failures:
+			self.reply(failures.pop(0), b'', {'Retry-After': '0'})
+		else:
+			self.reply(200, json.dumps({'lines': [{'words': track_id}]}).encode())
+
+	def reply(self, status: int, body: bytes, headers: dict = {}):
+		self.send_response(status)
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def server():
+	server = ThreadingHTTPServer(('127.0.0.1', 0), LyricsAPI)
+	server.requests = []
+	server.failures = {}
+	Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+@pytest.fixture(params=['httpx', 'requests'])
+def client_library(request, monkeypatch):
+	if request.param == 'httpx':
+		if scrape_lyrics.httpx is None:
+			pytest.skip("httpx is not installed")
+	else:
+		monkeypatch.setattr(scrape_lyrics, 'httpx', None)
+	return request.param
+
+def scrape(server, tmp_path, track_ids, concurrency=2, rate=20.0) -> ScrapeState:
+	state = ScrapeState(tmp_path)
+	try:
+		asyncio.run(scrape_async(track_ids, state, concurrency, rate, f"http://127.0.0.1:{server.server_port}/"))
+	finally:
+		state.close()
+	return state
+
+def test_retries_and_missing(server, tmp_path, client_library):
+	state = scrape(server, tmp_path, ['ok', 'busy', 'flaky', 'missing'])
+
+	assert state.downloaded == {'ok', 'busy', 'flaky'}
+	assert json.loads((tmp_path / 'busy.json').read_text()) == {'lines': [{'words': 'busy'}]}
+	assert state.missing == {'missing'}
+	assert (tmp_path / '.missing').read_text().split() == ['missing']
+
+	attempts = [track_id for track_id, _ in server.requests]
+	assert attempts.count('busy') == 3
+	assert attempts.count('flaky') == 2
+	assert attempts.count('ok') == 1
+
+	journal = [json.loads(line) for line in (tmp_path / '.journal').read_text().splitlines()]
+	assert sorted((entry['id'], entry['status']) for entry in journal) == [
+		('busy', 'downloaded'), ('flaky', 'downloaded'), ('missing', 'missing'), ('ok', 'downloaded'),
+	]
+
+	# A second run has nothing left to ask for
+	state = ScrapeState(tmp_path)
+	assert state.pending(['ok', 'busy', 'flaky', 'missing', 'new']) == ['new']
+	state.close()
+
+def test_rate_limit(server, tmp_path, client_library):
+	track_ids = [f'song{i}' for i in range(8)]
+	scrape(server, tmp_path, track_ids, concurrency=2, rate=20.0)
+
+	times = sorted(time for _, time in server.requests)
+	assert len(times) == 8
+	# A burst of `concurrency`, then one request every 1 / rate seconds
+	assert times[-1] - times[0] >= (8 - 2) / 20.0 * 0.9
+
+def test_token_bucket_burst():
+	bucket = TokenBucket(rate=50.0, capacity=3)
+	start = monotonic()
+	for _ in range(3):
+		bucket.acquire()
+	assert monotonic() - start < 0.02
+	for _ in range(5):
+		bucket.acquire()
+	assert monotonic() - start >= 5 / 50.0 * 0.9
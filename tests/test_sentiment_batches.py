@@ -0,0 +1,43 @@
+import parse_lyrics
+from parse_lyrics import batch_lines, corpus_sentiment, sentiment_batches, split_batch
+
+SONGS = [
+	("a", [["one two", "three"], ["four"]]),
+	("b", [["five six seven"]]),
+	("c", []),
+	("d", [["eight", "nine"], ["ten"], ["eleven"]]),
+]
+
+def fake_sentiment(lines):
+	return [{"line": line} for line in lines]
+
+def test_sentiment_batches_respect_budget():
+	batches = list(sentiment_batches(SONGS, max_lines=3, max_tokens=100))
+	assert [[key for key, _ in batch] for batch in batches] == [["a"], ["b", "c"], ["d"]]
+
+	batches = list(sentiment_batches(SONGS, max_lines=100, max_tokens=7))
+	assert [[key for key, _ in batch] for batch in batches] == [["a", "b", "c"], ["d"]]
+
+def test_song_over_budget_is_its_own_batch():
+	batches = list(sentiment_batches(SONGS, max_lines=1, max_tokens=1))
+	assert [[key for key, _ in batch] for batch in batches] == [["a"], ["b"], ["c"], ["d"]]
+
+def test_split_batch_reassembles_songs():
+	batch = SONGS
+	results = fake_sentiment(batch_lines(batch))
+	assert dict(split_batch(batch, results)) == {
+		key: [[{"line": line} for line in stanza_lines] for stanza_lines in stanzas_lines]
+		for key, stanzas_lines in SONGS
+	}
+
+def test_corpus_sentiment_keeps_song_order(monkeypatch):
+	requests = []
+	def sentiment(lines):
+		requests.append(lines)
+		return fake_sentiment(lines)
+	monkeypatch.setattr(parse_lyrics.services, "sentiment", sentiment)
+
+	results = list(corpus_sentiment(SONGS, max_lines=3, max_tokens=100))
+	assert [key for key, _ in results] == ["a", "b", "c", "d"]
+	assert results[3][1] == [[{"line": "eight"}, {"line": "nine"}], [{"line": "ten"}], [{"line": "eleven"}]]
+	assert len(requests) == 3
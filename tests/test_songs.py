@@ -0,0 +1,39 @@
+import songs
+from songs import SongIndex
+
+HEADER = "spotify,release_year,genre,artist_name\n"
+
+def write_csv(path, rows):
+	path.write_text(HEADER + "".join(f"https://open.spotify.com/track/{track_id},{year},{genre},{artist}\n" for track_id, year, genre, artist in rows))
+
+def cached_only(cls, path):
+	raise AssertionError("rebuilt from the CSV")
+
+def test_sidecar_invalidation(tmp_path, monkeypatch):
+	path = tmp_path / "top_songs.csv"
+	write_csv(path, [("a", 1975, "rock", "x"), ("b", "", "pop", "y")])
+
+	index = SongIndex.load(path)
+	assert (tmp_path / "top_songs.csv.idx").exists()
+	assert list(index.track_ids()) == ["a", "b"]
+	assert {group: list(ids) for group, ids in index.groups('decade')} == {'': ["b"], '70s': ["a"]}
+
+	with monkeypatch.context() as patch:
+		patch.setattr(SongIndex, "from_csv", classmethod(cached_only))
+		assert list(SongIndex.load(path).track_ids()) == ["a", "b"]
+
+	# Any change to the CSV rebuilds the index
+	write_csv(path, [("a", 1975, "rock", "x"), ("b", "", "pop", "y"), ("c", 1992, "rock", "z")])
+	index = SongIndex.load(path)
+	assert list(index.track_ids()) == ["a", "b", "c"]
+	assert {group: list(ids) for group, ids in index.groups('genre')} == {"pop": ["b"], "rock": ["a", "c"]}
+
+	# So does a new sidecar layout
+	monkeypatch.setattr(songs, "INDEX_VERSION", songs.INDEX_VERSION + 1)
+	rebuilt = []
+	def from_csv(cls, path):
+		rebuilt.append(path)
+		return index
+	monkeypatch.setattr(SongIndex, "from_csv", classmethod(from_csv))
+	SongIndex.load(path)
+	assert rebuilt == [path]
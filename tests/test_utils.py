@@ -0,0 +1,27 @@
+from multiprocessing import get_context
+import os
+from utils import chunked, per_process
+
+@per_process
+def instance(*args) -> list:
+	return [os.getpid(), *args]
+
+def instance_pid() -> int:
+	return instance()[0]
+
+def test_per_process_reuses_instances():
+	assert instance() is instance()
+	assert instance(1) is instance(1)
+	assert instance(1) is not instance(2)
+
+def test_per_process_makes_new_instances_after_fork():
+	assert instance_pid() == os.getpid()
+	with get_context("fork").Pool(1) as pool:
+		child = pool.apply(os.getpid)
+		assert pool.apply(instance_pid) == child
+	assert child != os.getpid()
+	assert instance_pid() == os.getpid()
+
+def test_chunked():
+	assert list(chunked([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+	assert list(chunked([], 2)) == []
@@ -0,0 +1,38 @@
+from columns import ColumnStore
+from vocabulary import FrequencyMatrix
+
+def fill(store: ColumnStore):
+	store.append(dict(id="a", freqs=[{"love": 2, "baby": 1}, {"love": 1}]))
+	store.append(dict(id="b", freqs=[{"money": 3}]))
+	store.append(dict(id="c", freqs=[{"baby": 1, "car": 2}]))
+	# Re-parsed: only this row of "b" counts
+	store.append(dict(id="b", freqs=[{"money": 1, "love": 1}]))
+
+def test_group_and_category_totals(tmp_path):
+	with ColumnStore(tmp_path / "columns") as store:
+		fill(store)
+		matrix = FrequencyMatrix.load(store, tmp_path / "frequencies.npz")
+
+	groups = {"70s": ["a", "b"], "80s": ["c", "missing"], "90s": []}
+	assert matrix.group_frequencies(groups) == {
+		"70s": {"love": 4, "baby": 1, "money": 1},
+		"80s": {"baby": 1, "car": 2},
+		"90s": {},
+	}
+
+	counts, totals = matrix.category_totals(groups, {"romance": ["love", "baby"], "wealth": ["money", "car", "yacht"]})
+	assert counts.tolist() == [[5, 1], [1, 2], [0, 0]]
+	assert totals.tolist() == [6, 3, 0]
+
+def test_load_only_reads_new_rows(tmp_path):
+	path = tmp_path / "frequencies.npz"
+	with ColumnStore(tmp_path / "columns") as store:
+		store.append(dict(id="a", freqs=[{"love": 1}]))
+		FrequencyMatrix.load(store, path)
+		store.append(dict(id="b", freqs=[{"love": 2, "money": 1}]))
+		matrix = FrequencyMatrix.load(store, path)
+
+	assert matrix.song_ids == ["a", "b"]
+	assert matrix.counts.shape == (2, 2)
+	assert matrix.group_frequencies({"all": ["a", "b"]}) == {"all": {"love": 3, "money": 1}}
+	assert not matrix.extend(store)
@@ -0,0 +1,35 @@
+"""
+Helpers shared by the caches and the service clients.
+"""
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+import os
+
+T = TypeVar("T")
+
+# SQLite's default limit on host parameters is 999
+QUERY_CHUNK_SIZE = 500
+
+def chunked(items: List[T], size: int) -> Iterator[List[T]]:
+	return (items[i:i + size] for i in range(0, len(items), size))
+
+def per_process(factory: Callable[..., T]) -> Callable[..., T]:
+	"""
+	Make `factory` return one instance per process and set of arguments.
+	SQLite connections and sockets must not cross a fork, so Pool workers
+	each make their own.
+	"""
+	instances: Dict[tuple, T] = {}
+	owner: Optional[int] = None
+
+	@wraps(factory)
+	def instance(*args) -> T:
+		nonlocal owner
+		if owner != os.getpid():
+			instances.clear()
+			owner = os.getpid()
+		if args not in instances:
+			instances[args] = factory(*args)
+		return instances[args]
+
+	return instance
@@ -0,0 +1,157 @@
+"""
+Word frequencies as a sparse songs x vocabulary matrix. Every lemma gets an
+integer id, each row of the column store becomes one sparse count vector, and
+grouping or filtering by category becomes a matrix product:
+
+	group totals    = G @ X         (groups x songs) @ (songs x vocabulary)
+	category totals = G @ X @ M     M[:, c] is category c's membership mask
+
+The matrix is cached in parsings/frequencies.npz and only rows appended to
+the store since it was built are read on the next load.
+"""
+from array import array
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Tuple
+import json
+import numpy as np
+from scipy import sparse
+from columns import ColumnStore
+
+DEFAULT_PATH = Path.cwd() / "parsings" / "frequencies.npz"
+
+class Vocabulary:
+	words: List[str]
+	index: Dict[str, int]
+
+	def __init__(self, words: Iterable[str] = ()):
+		self.words = []
+		self.index = {}
+		for word in words:
+			self.add(word)
+
+	def add(self, word: str) -> int:
+		if (word_id := self.index.get(word)) is None:
+			word_id = self.index[word] = len(self.words)
+			self.words.append(word)
+		return word_id
+
+	def mask(self, words: Iterable[str]) -> np.ndarray:
+		mask = np.zeros(len(self.words), dtype=bool)
+		mask[[self.index[word] for word in words if word in self.index]] = True
+		return mask
+
+	def __len__(self) -> int:
+		return len(self.words)
+
+class FrequencyMatrix:
+	vocabulary: Vocabulary
+	# One row per column store row, superseded rows included
+	counts: sparse.csr_matrix
+	song_ids: List[str]
+
+	def __init__(self, vocabulary: Vocabulary, counts: sparse.csr_matrix, song_ids: List[str]):
+		self.vocabulary = vocabulary
+		self.counts = counts
+		self.song_ids = song_ids
+
+	@classmethod
+	def load(cls, store: ColumnStore, path: Path = DEFAULT_PATH) -> "FrequencyMatrix":
+		if path.exists():
+			with np.load(path, allow_pickle=False) as f:
+				counts = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+				vocabulary = Vocabulary(json.loads(str(f['vocabulary'])))
+				song_ids = json.loads(str(f['song_ids']))
+			matrix = cls(vocabulary, counts, song_ids)
+		else:
+			matrix = cls(Vocabulary(), sparse.csr_matrix((0, 0), dtype=np.int64), [])
+
+		if matrix.extend(store):
+			matrix.save(path)
+		return matrix
+
+	def extend(self, store: ColumnStore) -> bool:
+		"""
+		Add the rows appended to `store` since this matrix was built.
+		"""
+		start = len(self.song_ids)
+		indptr = array('q', [0])
+		indices = array('q')
+		data = array('q')
+
+		for _, song_id, stanzas_freqs in store.scan_rows('freqs', start=start):
+			song_counts: Dict[int, int] = {}
+			for stanza_freqs in stanzas_freqs:
+				for word, count in stanza_freqs.items():
+					word_id = self.vocabulary.add(word)
+					song_counts[word_id] = song_counts.get(word_id, 0) + count
+			indices.extend(song_counts.keys())
+			data.extend(song_counts.values())
+			indptr.append(len(indices))
+			self.song_ids.append(song_id)
+
+		if len(self.song_ids) == start:
+			return False
+
+		new_rows = sparse.csr_matrix(
+			(np.frombuffer(data, dtype=np.int64), np.frombuffer(indices, dtype=np.int64), np.frombuffer(indptr, dtype=np.int64)),
+			shape=(len(self.song_ids) - start, len(self.vocabulary)),
+		)
+		old_rows = self.counts.copy()
+		old_rows.resize((start, len(self.vocabulary)))
+		self.counts = sparse.vstack([old_rows, new_rows], format='csr')
+		return True
+
+	def save(self, path: Path = DEFAULT_PATH):
+		path.parent.mkdir(parents=True, exist_ok=True)
+		temporary = path.with_name(f"{path.stem}.tmp.npz")
+		np.savez(
+			temporary,
+			data=self.counts.data,
+			indices=self.counts.indices,
+			indptr=self.counts.indptr,
+			shape=np.array(self.counts.shape),
+			vocabulary=json.dumps(self.vocabulary.words),
+			song_ids=json.dumps(self.song_ids),
+		)
+		temporary.replace(path)
+
+	def group_matrix(self, groups: Dict[Hashable, Iterable[str]]) -> sparse.csr_matrix:
+		"""
+		groups x rows indicator matrix selecting the latest row of every song in
+		each group.
+		"""
+		latest = {song_id: row for row, song_id in enumerate(self.song_ids)}
+		group_rows = array('q')
+		song_rows = array('q')
+		for group_index, track_ids in enumerate(groups.values()):
+			rows = {latest[track_id] for track_id in track_ids if track_id in latest}
+			group_rows.extend([group_index] * len(rows))
+			song_rows.extend(rows)
+
+		return sparse.csr_matrix(
+			(np.ones(len(song_rows), dtype=np.int64), (np.frombuffer(group_rows, dtype=np.int64), np.frombuffer(song_rows, dtype=np.int64))),
+			shape=(len(groups), len(self.song_ids)),
+		)
+
+	def group_totals(self, groups: Dict[Hashable, Iterable[str]]) -> sparse.csr_matrix:
+		"""
+		groups x vocabulary word counts.
+		"""
+		return (self.group_matrix(groups) @ self.counts).tocsr()
+
+	def group_frequencies(self, groups: Dict[Hashable, Iterable[str]]) -> Dict[Hashable, Dict[str, int]]:
+		totals = self.group_totals(groups)
+		words = self.vocabulary.words
+		return {
+			group: {words[word_id]: int(count) for word_id, count in zip(row.indices, row.data)}
+			for group, row in zip(groups.keys(), totals)
+		}
+
+	def category_totals(self, groups: Dict[Hashable, Iterable[str]], word_lists: Dict[str, Iterable[str]]) -> Tuple[np.ndarray, np.ndarray]:
+		"""
+		Returns (groups x categories counts, total words per group), with
+		categories in the order of `word_lists`.
+		"""
+		masks = np.stack([self.vocabulary.mask(word_list) for word_list in word_lists.values()], axis=1).astype(np.int64)
+		totals = self.group_totals(groups)
+		return np.asarray(totals @ masks), np.asarray(totals.sum(axis=1)).ravel()